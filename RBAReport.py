@@ -8,11 +8,30 @@
 from argparse import ArgumentParser, Namespace
 import argparse
 import re
-from database import Database
+from database import Database, DatabaseError, dPragmaProfiles
 from report_table import Report
-from datetime import datetime, timedelta
+from schema_manager import tableKeyFields, tableUpdateField, createKeyIndex, createLoadTables, createTicketEventTables, createHolidayTable, \
+    createSLAPolicyTable
+from query_audit import auditQueries
+from business_calendar import BusinessCalendar, minutesFromDuration, loadBusinessCalendar
+from sla_policy import SLAPolicies, defaultTargets, loadSLAPolicies
+from datetime import datetime
 import csv
 import calendar
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+import glob
+import os
+import hashlib
+import atexit
+from string_functions import flatten
+from typing import Union
+from time import perf_counter
+from contextlib import contextmanager, redirect_stdout
+import io
+from globals import GlobalVars
+import debug_routines as out
 
 oDatabase: Database
 
@@ -26,11 +45,30 @@ def parseCommandLine() -> Namespace:
     # switches
     oParserCmdLine.add_argument('--update', action='store_const', const=True, default=False, help='Update a record type')
     oParserCmdLine.add_argument('--exclude', action='store_const', const=True, default=False, help='Exclude from reporting')
+    oParserCmdLine.add_argument('--force', action='store_const', const=True, default=False, help='Load a file even if it has been loaded before')
+    oParserCmdLine.add_argument('--events', action='store_const', const=True, default=False, help='Parse the comments of all tickets into TicketEvent')
+    oParserCmdLine.add_argument('--snapshot', type=str, nargs='?', const=':memory:', default='',
+                                help="Work on a copy of the database, in memory or 'temp' for a local temporary file, written back only if changed")
+    oParserCmdLine.add_argument('--querystats', action='store_const', const=True, default=False,
+                                help='Print the time taken by each SQL statement at the end, and the slow query log')
+    oParserCmdLine.add_argument('--audit', action='store_const', const=True, default=False,
+                                help='Explain the SQL run (reports 1 to 4 if nothing else is asked for) and propose indexes for scans and sorts')
+    oParserCmdLine.add_argument('--apply', action='store_const', const=True, default=False, help='Create the indexes proposed by --audit')
     oParserCmdLine.add_argument('--summary', action='store_const', const=True, default=False, help='Print the summary tables')
 
     # data load
     oParserCmdLine.add_argument('-table', type=str, help='Table to load.')
     oParserCmdLine.add_argument('-file', type=str, help='File to load.')
+    oParserCmdLine.add_argument('-load', type=str, nargs='+', help='Load several files at once, each a table=file pair, a directory or a glob.')
+    oParserCmdLine.add_argument('-workers', type=int, help='Number of processes reading files for -load, defaults to one per file up to the CPU count.')
+    oParserCmdLine.add_argument('-batchsize', type=int, default=5000, help='Rows written per executemany() batch when loading.')
+    oParserCmdLine.add_argument('-loadmode', type=str, default='upsert', choices=['upsert', 'classify', 'staging', 'incremental'],
+                                help='upsert merges rows on the unique key in SQLite, classify decides insert/update/ignore in Python, '
+                                     'staging merges a TEMP copy of the file with set based statements, incremental only writes rows whose content changed.')
+    oParserCmdLine.add_argument('-commitrows', type=int, default=0, help='Rows written per commit when loading, 0 commits once at the end.')
+    oParserCmdLine.add_argument('-slowms', type=int, default=100, help='Milliseconds a query must take to go in the slow query log of --querystats.')
+    oParserCmdLine.add_argument('-profile', type=str, choices=list(dPragmaProfiles),
+                                help='Database settings to run with, defaults to bulk-load for loads, safe for updates and report-readonly for reports.')
 
     # updates
     oParserCmdLine.add_argument('-incident', type=str, help='Incident to update.')
@@ -38,9 +76,14 @@ def parseCommandLine() -> Namespace:
     oParserCmdLine.add_argument('-request', type=str, help='Request to update.')
     oParserCmdLine.add_argument('-notes', type=str, help='Notes to add.')
     oParserCmdLine.add_argument('-service', type=str, help='Incident to update.')
+    oParserCmdLine.add_argument('-holidays', type=str, help='CSV file of public holidays to load, with Region, Date and Name columns.')
+    oParserCmdLine.add_argument('-policies', type=str, help='CSV file of SLA targets to load, with RecordType, Metric, Priority, Service and Target (d:hh:mm) '
+                                                             'columns.')
 
     # reporting
     oParserCmdLine.add_argument('-month', type=int, help='Month to process for report.')
+    oParserCmdLine.add_argument('-year', type=int, default=2024, help='Year of the month to process for report.')
+    oParserCmdLine.add_argument('-region', type=str, default='NSW', help='Region whose public holidays are not business days.')
     oParserCmdLine.add_argument('-report', type=int, help='Type of report to produce.')
 
     return oParserCmdLine.parse_args()
@@ -75,57 +118,140 @@ def parseCommentsAndWorkNotes(sText: str) -> list[tuple[datetime, str, str, str]
     return updates
 
 
-lPublicHolidays = [datetime(2024, 4, 25).date(), datetime(2024, 6, 10).date(), datetime(2024, 8, 5).date()]
-
-
-def calculateBusinessTimeDuration(dtStart: datetime, sDaysHoursMinutes: str) -> datetime:
+def refreshTicketEvents(sTableName: str, lNumbers: Union[list, None] = None) -> int:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Parse the comments and work notes of the tickets in the table into TicketEvent, for the tickets in lNumbers or all of them if None.
+    #   A ticket is only parsed again if its comments have changed since it was last parsed. Returns the number of tickets parsed.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    createTicketEventTables(oDatabase)
+    dHashes = dict(oDatabase.fetchList("SELECT Number, Hash FROM TicketEventSource"))
 
-    # Define business hours
-    tdBusinessStart = timedelta(hours=7)
-    tdBusinessEnd = timedelta(hours=18)
+    sSQL = f"SELECT Number, CommentsAndWorkNotes FROM {sTableName}"
+    if lNumbers is None:
+        lChunks = batchRows(oDatabase.fetchIter(sSQL), 500)
+    else:
+        lChunks = (oDatabase.fetchList(f"{sSQL} WHERE Number IN ({', '.join(['?'] * len(lChunk))})", tuple(lChunk))
+                   for lChunk in batchRows(lNumbers, 500))
+
+    iParsed = 0
+    with oDatabase.transaction():
+        for lRows in lChunks:
+            lEvents = []
+            lSources = []
+            for sNumber, sText in lRows:
+                sHash = hashlib.blake2b((sText or '').encode(), digest_size=16).hexdigest()
+                if dHashes.get(sNumber) != sHash:
+                    for iSeq, (dtUpdate, sPerson, sUpdateType, sUpdate) in enumerate(parseCommentsAndWorkNotes(sText or '')):
+                        lEvents.append((sNumber, iSeq, dtUpdate.strftime('%Y-%m-%d %H:%M:%S'), sPerson, sUpdateType, sUpdate))
+                    lSources.append((sNumber, sHash))
+                    dHashes[sNumber] = sHash
+
+            if lSources:
+                oDatabase.executeMany("DELETE FROM TicketEvent WHERE Number = ?", [(sNumber,) for sNumber, _sHash in lSources])
+                oDatabase.executeMany("INSERT INTO TicketEvent (Number, Seq, Timestamp, Person, UpdateType, Body) VALUES (?, ?, ?, ?, ?, ?)", lEvents)
+                oDatabase.executeMany("INSERT INTO TicketEventSource (Number, Hash) VALUES (?, ?) ON CONFLICT (Number) DO UPDATE SET Hash = excluded.Hash", lSources)
+                iParsed += len(lSources)
+
+    return iParsed
+
+
+def fetchTicketEvents(sTableName: str, sNumber: str, bBody: bool = False) -> list[tuple[datetime, str, str, str]]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the same list as parseCommentsAndWorkNotes() for the ticket, from TicketEvent where the ticket has been parsed at load time.
+    #   The update text is only read if bBody is set, otherwise it is None. Tickets not yet parsed have their comments fetched and parsed here.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    if oDatabase.fetchValue("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'TicketEventSource'") and \
+            oDatabase.fetchValue("SELECT COUNT(*) FROM TicketEventSource WHERE Number = ?", (sNumber,)):
+        sBody = 'Body' if bBody else 'NULL'
+        return [(datetime.fromisoformat(sTimestamp), sPerson, sUpdateType, sUpdate) for sTimestamp, sPerson, sUpdateType, sUpdate in
+                oDatabase.fetchList(f"SELECT Timestamp, Person, UpdateType, {sBody} FROM TicketEvent WHERE Number = ? ORDER BY Seq", (sNumber,))]
 
-    sParts = sDaysHoursMinutes.split(':')
-    iSLADays = int(sParts[0])
-    iSLAHours = int(sParts[1])
-    iSLAMinutes = int(sParts[2])
+    return parseCommentsAndWorkNotes(oDatabase.fetchValue(f"SELECT CommentsAndWorkNotes FROM {sTableName} WHERE Number = ?", (sNumber,)) or '')
 
-    # if this day is not a business day then it just needs to be advanced to the next business day at start of business day
-    if not (dtStart.weekday() < 5 and dtStart.date() not in lPublicHolidays):
-        while not (dtStart.weekday() < 5 and dtStart.date() not in lPublicHolidays):  # Monday to Friday, not a public holiday
-            dtStart += timedelta(days=1)
-        dtStart -= (timedelta(hours=dtStart.hour, minutes=dtStart.minute) - tdBusinessStart)
 
-    # now set the end date
-    dtEnd = dtStart
+def fetchTicketEventMap(sTableName: str, sWhere: str, tData: tuple) -> dict:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns a {Number: events} dictionary for the tickets in sTableName selected by the WHERE clause, each the list fetchTicketEvents() returns.
+    #   The parsed tickets are read from TicketEvent in one query, without the update text, and the comments of any not yet parsed in another.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    dEvents = {}
+    sNotParsed = ''
+    if oDatabase.fetchValue("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'TicketEventSource'"):
+        sTickets = f"SELECT Number FROM {sTableName} WHERE {sWhere}"
+        for (sNumber,) in oDatabase.fetchIter(f"SELECT Number FROM TicketEventSource WHERE Number IN ({sTickets})", tData):
+            dEvents[sNumber] = []
+        for sNumber, sTimestamp, sPerson, sUpdateType in oDatabase.fetchIter(f"SELECT Number, Timestamp, Person, UpdateType FROM TicketEvent "
+                                                                             f"WHERE Number IN ({sTickets}) ORDER BY Number, Seq", tData):
+            dEvents[sNumber].append((datetime.fromisoformat(sTimestamp), sPerson, sUpdateType, None))
+        sNotParsed = " AND Number NOT IN (SELECT Number FROM TicketEventSource)"
+
+    for sNumber, sText in oDatabase.fetchIter(f"SELECT Number, CommentsAndWorkNotes FROM {sTableName} WHERE {sWhere}{sNotParsed}", tData):
+        dEvents[sNumber] = parseCommentsAndWorkNotes(sText or '')
+    return dEvents
+
+
+def teamTouches(lEvents: list, lTeam: list, lCustomerTeam: list) -> tuple[Union[datetime, None], Union[datetime, None], list]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Works out from a ticket's updates (oldest first) when the team first touched it, the last update by someone outside both teams before
+    #   that (when the ticket was potentially received), and the (from, to) periods it was with another team after the team had worked on it.
+    #   Updates by the customer's team (lCustomerTeam) are ignored.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    dtFirstTeamTouch = None
+    dtReceiveNonTeamTouch = None
+
+    lOtherTeamTransfers = []
+    dtTeamTouch = dtOtherTeamTouch = None
+    for dtUpdate, sPerson, _sUpdateType, _sUpdateContent in lEvents:
+        if sPerson in lTeam:
+            if dtFirstTeamTouch is None:
+                # this is the timestamp at which we have received the ticket
+                dtFirstTeamTouch = dtUpdate
+
+            if dtOtherTeamTouch:
+                # another team has been working on the ticket, this time needs to be excluded
+                lOtherTeamTransfers.append((dtTeamTouch, dtOtherTeamTouch))
+                dtOtherTeamTouch = None
+            dtTeamTouch = dtUpdate
+
+        elif sPerson not in lCustomerTeam:
+            if dtFirstTeamTouch is None:
+                # this is potentially the time as which we have received the ticket, i.e. if helpdesk are updating it
+                dtReceiveNonTeamTouch = dtUpdate
+            else:
+                # ITIMS HV team have updated the ticket, now it's being updated by other teams, this ticket has been transferred
+                dtOtherTeamTouch = dtUpdate
 
-    # if the start time is prior to business hours start then move it forward
-    if timedelta(hours=dtStart.hour, minutes=dtStart.minute) < tdBusinessStart:
-        dtEnd += (tdBusinessStart - timedelta(hours=dtStart.hour, minutes=dtStart.minute))
+    return dtFirstTeamTouch, dtReceiveNonTeamTouch, lOtherTeamTransfers
 
-    # if the open time is already past the end of business day, then move it forward one day and set the start time
-    if timedelta(hours=dtStart.hour, minutes=dtStart.minute) > tdBusinessEnd:
-        iSLADays += 1
-        dtEnd -= (timedelta(hours=dtStart.hour, minutes=dtStart.minute) - tdBusinessStart)
 
-    # add the minutes and hours
-    dtEnd += timedelta(hours=iSLAHours, minutes=iSLAMinutes)
+def fetchSLAOverrides(sTableName: str, sWhere: str, tData: tuple) -> dict:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns a {(Number, SLA): (StartTime, EndTime)} dictionary of the SLA overrides of the tickets in sTableName selected by the WHERE clause,
+    #   in one query rather than one per ticket. Where a ticket has more than one override for an SLA the first is used, as the query per ticket did.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    dOverrides = {}
+    for sNumber, sSLA, sStartTime, sEndTime in oDatabase.fetchIter(f"SELECT Number, SLA, StartTime, EndTime FROM SLAOverride WHERE Number IN "
+                                                                   f"(SELECT Number FROM {sTableName} WHERE {sWhere})", tData):
+        dOverrides.setdefault((sNumber, sSLA), (sStartTime, sEndTime))
+    return dOverrides
 
-    # now if the end time is before business hours it's because it's wrapped into the next day
-    if timedelta(hours=dtEnd.hour, minutes=dtEnd.minute) < tdBusinessStart:
-        dtEnd = dtEnd + tdBusinessStart + timedelta(hours=6)
 
-    # now if the end time is past business hours then move it to the next day
-    if timedelta(hours=dtEnd.hour, minutes=dtEnd.minute) > tdBusinessEnd:
-        iSLADays += 1
-        dtEnd -= (tdBusinessEnd - tdBusinessStart)
+def fetchIncidentSLAs(sWhere: str, tData: tuple) -> dict:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns a {Number: [(SLADefinition, StartTime, StopTime), ...]} dictionary of the IncidentSLA rows of the incidents selected by the WHERE
+    #   clause, in one query. The rows are in key order (SLA definition then stage), the order the key index gave the queries per incident.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    dSLAs = {}
+    for sNumber, sSLADefinition, sStartTime, sStopTime in oDatabase.fetchIter(f"SELECT Number, SLADefinition, StartTime, StopTime FROM IncidentSLA WHERE Number IN "
+                                                                              f"(SELECT Number FROM Incident WHERE {sWhere}) ORDER BY Number, SLADefinition, Stage", tData):
+        dSLAs.setdefault(sNumber, []).append((sSLADefinition, sStartTime, sStopTime))
+    return dSLAs
 
-    # Process days
-    while iSLADays > 0:
-        dtEnd += timedelta(days=1)
-        if dtEnd.weekday() < 5 and dtEnd.date() not in lPublicHolidays:  # Monday to Friday, not a public holiday
-            iSLADays -= 1
 
-    return dtEnd
+# the NSW holidays used when the database has none for the region, the calendar is replaced by the region's at start up
+lPublicHolidays = [datetime(2024, 4, 25).date(), datetime(2024, 6, 10).date(), datetime(2024, 8, 5).date()]
+oBusinessCalendar = BusinessCalendar(lPublicHolidays)
+oSLAPolicies = SLAPolicies(oBusinessCalendar, defaultTargets())
 
 
 def calculateActualTimeDiff(dtStart: datetime, dtEnd: datetime) -> tuple[int, int, int]:
@@ -156,215 +282,852 @@ def subtractDuration(tTotal, tSubtract) -> tuple[int, int, int]:
 
 
 def calculateBusinessTimeDiff(dtStart: datetime, dtEnd: datetime) -> tuple[int, int, int]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the business time from dtStart to dtEnd as (days, hours, minutes) of 11 hour business days, see BusinessCalendar.timeDiff()
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    return oBusinessCalendar.timeDiff(dtStart, dtEnd)
+
+
+def readCSVFile(filePath, encoding='utf-8', oStats=None):
+    # Generator that yields each row of the CSV file as a list, so the file is never held in memory as a whole.
+    # A UnicodeDecodeError is raised to the caller, as rows before the bad one may already have been used.
+    # If a LoadStats is given its count of bytes read is kept up to date, every 1000 rows.
+
+    # Open the CSV file with the specified encoding
+    with open(filePath, mode='r', newline='', encoding=encoding) as csv_file:
+        # Create a CSV reader object and hand back each row as it is read
+        for iRow, row in enumerate(csv.reader(csv_file)):
+            if oStats is not None and not iRow % 1000:
+                oStats.iBytesRead = csv_file.buffer.tell()
+            yield row
+
+        if oStats is not None:
+            oStats.iBytesRead = csv_file.buffer.tell()
+
+
+# CSV export column names (with '.' replaced by '_') to database field names, for each table that can be loaded
+dFieldTranslations = {'Incident': dict(number='Number', opened_at='Opened', short_description='ShortDescription', caller_id='Caller',
+                                       priority='Priority', description='Description', comments_and_work_notes='CommentsAndWorkNotes', state='State',
+                                       category='Category', assignment_group='AssignmentGroup', assigned_to='AssignedTo', sys_updated_on='Updated',
+                                       closed_at='Closed', cmdb_ci='ConfigurationItem', sys_created_on='Created', resolved_at='Resolved',
+                                       subcategory='Subcategory', business_service='Service', close_code='ResolutionCode', close_notes='ResolutionNotes'),
+                      'IncidentSLA': dict(inc_number='Number', taskslatable_sla='SLADefinition', taskslatable_stage='Stage',
+                                          taskslatable_start_time='StartTime', taskslatable_end_time='StopTime',
+                                          taskslatable_planned_end_time='BreachTime', inc_made_sla='MadeSLA'),
+                      'Request': dict(request_item='RequestItem', number='Number', request_item_cat_item='Item', request_item_request_u_requested_by='RequestedBy',
+                                      request_item_requested_for='RequestedFor', state='State', priority='Priority', short_description='ShortDescription',
+                                      assignment_group='AssignmentGroup', assigned_to='AssignedTo', comments_and_work_notes='CommentsAndWorkNotes', opened_at='Opened',
+                                      closed_at='Closed', sys_updated_on='Updated'),
+                      'Change': dict(number='Number', type='Type', short_description='ShortDescription', state='State', start_date='PlannedStartDate', end_date='PlannedEndDate',
+                                     u_approval_stage='ApprovalStage', assigned_to='AssignedTo', comments='AdditionalComments', assignment_group='AssignmentGroup',
+                                     backout_plan='BackoutPlan', category='Category', close_code='CloseCode', closed_at='Closed', comments_and_work_notes='CommentsAndWorkNotes',
+                                     sys_created_on='Created', implementation_plan='ImplementationPlan', justification='Justification', risk_impact_analysis='RiskAndImpactAnalysis',
+                                     work_start='ActualStartDate', work_end='ActualEndDate', cmdb_ci='ConfigurationItem', business_service='BusinessService', u_environment='Environment',
+                                     sys_created_by='CreatedBy')}
+
+
+rExcelDateTime = re.compile(r"\b(0[1-9]|[12][0-9]|3[01])-(0[1-9]|1[0-2])-(\d{4})\s([01][0-9]|2[0-3]):([0-5][0-9]):([0-5][0-9])\b")
+rShortDateTime = re.compile(r"\b([1-9]|[12][0-9]|3[01])\/([1-9]|1[0-2])\/(\d{4})\s([0-9]|1[0-9]|2[0-3]):([0-5][0-9])\b")
+
+# Stricter versions of the two patterns for the per column converters. Anything that doesn't match these (a day after the 28th, a year
+# with a leading zero, whitespace other than a space, trailing text) goes through convertField() so the output is always the same.
+rFastExcelDateTime = re.compile(r"(0[1-9]|1[0-9]|2[0-8])-(0[1-9]|1[0-2])-([1-9][0-9]{3}) ([01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]\Z")
+rFastShortDateTime = re.compile(r"([1-9]|1[0-9]|2[0-8])/([1-9]|1[0-2])/([1-9][0-9]{3}) ([0-9]|1[0-9]|2[0-3]):([0-5][0-9])\Z")
 
-    # Define business hours
-    tdBusinessStart = timedelta(hours=7)
-    tdBusinessEnd = timedelta(hours=18)
 
-    # Initialize total business time difference
-    tdTotalBusinessTime = timedelta()
+def convertField(sField: str) -> str:
+    sExcelDateTimeFormat = '%d-%m-%Y %H:%M:%S'
+    if len(sField) == 19 and rExcelDateTime.match(sField):
+        dtField = datetime.strptime(sField, sExcelDateTimeFormat)
+        return dtField.strftime('%Y-%m-%d %H:%M:%S')
 
-    # Handle the case where the start and end dates are the same
-    if dtStart.date() == dtEnd.date():
-        if dtStart.weekday() < 5 and dtStart.date() not in lPublicHolidays:  # Monday to Friday
-            tdStartTime = max(tdBusinessStart, timedelta(hours=dtStart.hour, minutes=dtStart.minute))
-            tdEndTime = min(tdBusinessEnd, timedelta(hours=dtEnd.hour, minutes=dtEnd.minute))
-            if tdStartTime < tdEndTime:
-                tdTotalBusinessTime = tdEndTime - tdStartTime
-    else:
-        # Process the first day
-        if dtStart.weekday() < 5 and dtStart.date() not in lPublicHolidays:  # Monday to Friday
-            tdStartTime = max(tdBusinessStart, timedelta(hours=dtStart.hour, minutes=dtStart.minute))
-            tdEndTime = min(tdBusinessEnd, timedelta(hours=18))
-            if tdStartTime < tdEndTime:
-                tdTotalBusinessTime += tdEndTime - tdStartTime
-
-        # Process intermediate days
-        dtNextDay = dtStart + timedelta(days=1)
-        while dtNextDay.date() < dtEnd.date():
-            if dtNextDay.weekday() < 5 and dtNextDay.date() not in lPublicHolidays:  # Monday to Friday
-                # print(f"checking date {dtNextDay} which is day {dtNextDay.weekday()} and date {dtNextDay.date()} public holidays {lPublicHolidays}")
-                tdTotalBusinessTime += (tdBusinessEnd - tdBusinessStart)
-            dtNextDay += timedelta(days=1)
-
-        # Process the last day
-        if dtEnd.weekday() < 5 and dtEnd.date() not in lPublicHolidays:  # Monday to Friday
-            tdEndTime = min(tdBusinessEnd, timedelta(hours=dtEnd.hour, minutes=dtEnd.minute))
-            if tdBusinessStart < tdEndTime:
-                tdTotalBusinessTime += tdEndTime - tdBusinessStart
+    sExcelDateTimeFormat = '%d/%m/%Y %H:%M'
+    if len(sField) <= 16 and rShortDateTime.match(sField):
+        dtField = datetime.strptime(sField, sExcelDateTimeFormat)
+        return dtField.strftime('%Y-%m-%d %H:%M:%S')
 
-    # Calculate days, hours, and minutes
-    days = tdTotalBusinessTime.days
-    hours, remainder = divmod(tdTotalBusinessTime.seconds, 3600)
-    minutes = remainder // 60
+    return sField
 
-    rHours = days * 24 + hours + minutes/60
-    days = 0
-    while rHours > 11:
-        days += 1
-        rHours -= 11
-    hours = int(rHours)
-    minutes = round((rHours - hours) * 60)
 
-    return days, int(hours), int(minutes)
+def convertExcelDateTimeField(sField: str) -> str:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Converter for a column holding 'dd-mm-yyyy hh:mm:ss' values, the fields are rearranged without strptime()
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    if rFastExcelDateTime.match(sField):
+        return f"{sField[6:10]}-{sField[3:5]}-{sField[0:2]} {sField[11:19]}"
+    return convertField(sField)
 
 
-def readCSVFile(filePath, encoding='utf-8'):
-    # List to store each row as a list
-    data_list = []
+def convertShortDateTimeField(sField: str) -> str:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Converter for a column holding 'd/m/yyyy h:mm' values, the fields are zero padded without strptime()
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    oMatch = rFastShortDateTime.match(sField)
+    if oMatch:
+        sDay, sMonth, sYear, sHour, sMinute = oMatch.groups()
+        return f"{sYear}-{sMonth.zfill(2)}-{sDay.zfill(2)} {sHour.zfill(2)}:{sMinute}:00"
+    return convertField(sField)
 
-    try:
-        # Open the CSV file with the specified encoding
-        with open(filePath, mode='r', newline='', encoding=encoding) as csv_file:
-            # Create a CSV reader object
-            csv_reader = csv.reader(csv_file)
 
-            # Iterate over each row in the CSV file
-            for row in csv_reader:
-                # Add it to the list
-                data_list.append(row)
+def convertTextField(sField: str) -> str:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Converter for a column with no dates in the sample, only a field with a date separator in the right place is given to convertField()
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    iLength = len(sField)
+    if (iLength == 19 and sField[2] == '-') or (3 < iLength <= 16 and (sField[1] == '/' or sField[2] == '/')):
+        return convertField(sField)
+    return sField
 
-    except UnicodeDecodeError as e:
-        print(f"Error decoding file: {e}")
-        print("Try a different encoding, such as 'ISO-8859-1' or 'latin1'.")
-        return []
 
-    return data_list
+def detectColumnConverters(tFieldNames, lSampleRows: list) -> list:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Work out once per column which converter applies, using the header for the number of columns and the sample rows for the date formats.
+    #   A column is a date column if any of its sampled values is in one of the two date formats, every other column is treated as text.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    lConverters = []
+    for iField in range(len(tFieldNames)):
+        fnConverter = convertTextField
+        for lData in lSampleRows:
+            sField = lData[iField] if iField < len(lData) else ''
+            if len(sField) == 19 and rExcelDateTime.match(sField):
+                fnConverter = convertExcelDateTimeField
+                break
+            if len(sField) <= 16 and rShortDateTime.match(sField):
+                fnConverter = convertShortDateTimeField
+                break
+        lConverters.append(fnConverter)
+
+    return lConverters
+
+
+def convertRows(tFieldNames, iterRows, iSampleRows: int = 100):
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Pipeline stage that yields each CSV row with all the date fields converted to the database format.
+    #   The first iSampleRows rows are read ahead to pick a converter for each column, a row with the wrong number of fields uses convertField().
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    lSampleRows = list(islice(iterRows, iSampleRows))
+    lConverters = detectColumnConverters(tFieldNames, lSampleRows)
+    iColumns = len(lConverters)
 
+    for lData in chain(lSampleRows, iterRows):
+        if len(lData) == iColumns:
+            yield [fnConverter(field) for fnConverter, field in zip(lConverters, lData)]
+        else:
+            yield list(convertField(field) for field in lData)
 
-def convertField(sField: str) -> str:
-    datePattern = r"\b(0[1-9]|[12][0-9]|3[01])-(0[1-9]|1[0-2])-(\d{4})\s([01][0-9]|2[0-3]):([0-5][0-9]):([0-5][0-9])\b"
-    sExcelDateTimeFormat = '%d-%m-%Y %H:%M:%S'
-    if len(sField) == 19 and re.match(datePattern, sField):
-        dtField = datetime.strptime(sField, sExcelDateTimeFormat)
-        return dtField.strftime('%Y-%m-%d %H:%M:%S')
 
-    datePattern = r"\b([1-9]|[12][0-9]|3[01])\/([1-9]|1[0-2])\/(\d{4})\s([0-9]|1[0-9]|2[0-3]):([0-5][0-9])\b"
-    sExcelDateTimeFormat = '%d/%m/%Y %H:%M'
-    if len(sField) <= 16 and re.match(datePattern, sField):
-        dtField = datetime.strptime(sField, sExcelDateTimeFormat)
-        return dtField.strftime('%Y-%m-%d %H:%M:%S')
+def classifyRows(iterFields, dKeyIndex: dict, lKeyColumnNumbers: list, iUpdateColumnFieldNumber):
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Pipeline stage that yields ('insert', insert tuple), ('update', update tuple) or ('ignore', None) for each converted row.
+    #   The update tuple has the non key fields followed by the key fields. dKeyIndex is kept current so repeated keys in the file are handled.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    oUpdateField = None
 
-    return sField
+    for lFields in iterFields:
+        tKeyFields = tuple(field for iCtr, field in enumerate(lFields) if iCtr in lKeyColumnNumbers)
 
+        if iUpdateColumnFieldNumber:
+            oUpdateField = lFields[iUpdateColumnFieldNumber]
 
-def loadTableToDatabase(sTableName, lDataList):
-
-    dFieldTranslations = {'Incident': dict(number='Number', opened_at='Opened', short_description='ShortDescription', caller_id='Caller',
-                                           priority='Priority', description='Description', comments_and_work_notes='CommentsAndWorkNotes', state='State',
-                                           category='Category', assignment_group='AssignmentGroup', assigned_to='AssignedTo', sys_updated_on='Updated',
-                                           closed_at='Closed', cmdb_ci='ConfigurationItem', sys_created_on='Created', resolved_at='Resolved',
-                                           subcategory='Subcategory', business_service='Service', close_code='ResolutionCode', close_notes='ResolutionNotes'),
-                          'IncidentSLA': dict(inc_number='Number', taskslatable_sla='SLADefinition', taskslatable_stage='Stage',
-                                              taskslatable_start_time='StartTime', taskslatable_end_time='StopTime',
-                                              taskslatable_planned_end_time='BreachTime', inc_made_sla='MadeSLA'),
-                          'Request': dict(request_item='RequestItem', number='Number', request_item_cat_item='Item', request_item_request_u_requested_by='RequestedBy',
-                                          request_item_requested_for='RequestedFor', state='State', priority='Priority', short_description='ShortDescription',
-                                          assignment_group='AssignmentGroup', assigned_to='AssignedTo', comments_and_work_notes='CommentsAndWorkNotes', opened_at='Opened',
-                                          closed_at='Closed', sys_updated_on='Updated'),
-                          'Change': dict(number='Number', type='Type', short_description='ShortDescription', state='State', start_date='PlannedStartDate', end_date='PlannedEndDate',
-                                         u_approval_stage='ApprovalStage', assigned_to='AssignedTo', comments='AdditionalComments', assignment_group='AssignmentGroup',
-                                         backout_plan='BackoutPlan', category='Category', close_code='CloseCode', closed_at='Closed', comments_and_work_notes='CommentsAndWorkNotes',
-                                         sys_created_on='Created', implementation_plan='ImplementationPlan', justification='Justification', risk_impact_analysis='RiskAndImpactAnalysis',
-                                         work_start='ActualStartDate', work_end='ActualEndDate', cmdb_ci='ConfigurationItem', business_service='BusinessService', u_environment='Environment',
-                                         sys_created_by='CreatedBy')}
-
-    sInsertSQL = f'INSERT INTO {sTableName} ('
-    sUpdateSQL = f'UPDATE {sTableName} SET '
-    lInsertFields = []
-    lUpdateFields = []
-
-    lKeyPredicates = []
-    lTableKeyFields = []
-    lKeyColumnNumbers = []
-    sUpdateField = None
-    iUpdateColumnFieldNumber = None
-
-    if sTableName == 'Incident':
-        lTableKeyFields = ['Number']
-        sUpdateField = 'Updated'
-    elif sTableName == 'IncidentSLA':
-        lTableKeyFields = ['Number', 'SLADefinition', 'Stage']
-        sUpdateField = 'StopTime'
-    elif sTableName == 'Request':
-        lTableKeyFields = ['Number']
-        sUpdateField = 'Updated'
-    elif sTableName == 'Change':
-        lTableKeyFields = ['Number']
-        sUpdateField = ''
-
-    tFieldNames = lDataList[0]
-    for iField, sField in enumerate(tFieldNames):
-        sDBFieldName = dFieldTranslations[sTableName][sField.replace('.', '_')]
-        lInsertFields.append(sDBFieldName)
-        if sDBFieldName in lTableKeyFields:
-            lKeyColumnNumbers.append(iField)
-            lKeyPredicates.append(f'{sDBFieldName} = ?')
+        bFound = tKeyFields in dKeyIndex
+        oField = dKeyIndex.get(tKeyFields)
+
+        if not bFound:
+            # print(f"Field value {tKeyFields}, needs to be inserted into database.")
+            dKeyIndex[tKeyFields] = oUpdateField if iUpdateColumnFieldNumber else tKeyFields[0]
+            yield 'insert', tuple(lFields)
+        elif oField == oUpdateField:
+            # print(f"Field value {tKeyFields}, data is the same")
+            yield 'ignore', None
         else:
-            lUpdateFields.append(f'{sDBFieldName} = ?')
+            # print(f"Field value {tKeyFields}, value is {oField}, new value is {oUpdateField}.")
+            dKeyIndex[tKeyFields] = oUpdateField if iUpdateColumnFieldNumber else tKeyFields[0]
+            yield 'update', tuple(field for iCtr, field in enumerate(lFields) if iCtr not in lKeyColumnNumbers) + tKeyFields
 
-        if sDBFieldName == sUpdateField:
-            iUpdateColumnFieldNumber = iField
 
-    if iUpdateColumnFieldNumber:
-        sFindSQL = f"SELECT {sUpdateField} FROM {sTableName} WHERE {' AND '.join(lKeyPredicates)}"
-    else:
-        sFindSQL = f"SELECT {', '.join(lTableKeyFields)} FROM {sTableName} WHERE {' AND '.join(lKeyPredicates)}"
+# the stages of a table load, in the order they are reported
+lLoadStages = ['parse', 'convert', 'lookup', 'write', 'events']
 
-    sCountSQL = f"SELECT COUNT(*) FROM {sTableName} WHERE {' AND '.join(lKeyPredicates)}"
-    sInsertSQL += (', '.join(lInsertFields) + ') VALUES (' + '?, ' * (len(lInsertFields) - 1) + '?)')
 
-    # print(sFindSQL)
-    # print(sInsertSQL)
+class LoadStats:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Collects the time a table load spends in each stage and how many bytes of the file have been read.
+    #   Stages nest, time spent in an inner stage (the parse pulled through by convert, a batch written from inside the lookup loop)
+    #   is only counted against the inner stage, so the stage times add up to the time spent loading.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    def __init__(self) -> None:
+        self.dSeconds = {}
+        self.lStages = []
+        self.iBytesRead = 0
+        self.fStarted = perf_counter()
+        self.fFinished = None
+
+    def __addSeconds__(self, sStage: str, fSeconds: float) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine to close the innermost stage, taking its time off the stage it was running inside
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.lStages.pop()
+        self.dSeconds[sStage] = self.dSeconds.get(sStage, 0.0) + fSeconds
+        if self.lStages:
+            self.dSeconds[self.lStages[-1]] = self.dSeconds.get(self.lStages[-1], 0.0) - fSeconds
+
+    @contextmanager
+    def stage(self, sStage: str):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Context manager that counts the time in the block against the stage
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.lStages.append(sStage)
+        fStart = perf_counter()
+        try:
+            yield
+        finally:
+            self.__addSeconds__(sStage, perf_counter() - fStart)
+
+    def timeIter(self, sStage: str, iterRows):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Pipeline stage that passes the rows through, counting the time taken to produce each one against the stage
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        iterRows = iter(iterRows)
+        while True:
+            self.lStages.append(sStage)
+            fStart = perf_counter()
+            try:
+                lRow = next(iterRows, None)
+            finally:
+                self.__addSeconds__(sStage, perf_counter() - fStart)
+            if lRow is None:
+                return
+            yield lRow
+
+    def addSeconds(self, dSeconds: dict) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Add in stage times collected elsewhere, i.e. by a worker process
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        for sStage, fSeconds in dSeconds.items():
+            self.dSeconds[sStage] = self.dSeconds.get(sStage, 0.0) + fSeconds
+
+    def elapsed(self) -> float:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns the seconds since the load started, up to when it finished if it has
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        return (self.fFinished or perf_counter()) - self.fStarted
+
+    def printTimings(self, iRows: int) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Print the load time and rate, and how it breaks down by stage. Time not in any stage is shown as other.
+        #   Where the parse and convert ran in a worker process they overlap the rest, so the percentages are of the stage times added up.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        fElapsed = self.elapsed()
+        fStages = sum(self.dSeconds.values())
+        fOther = max(fElapsed - fStages, 0.0)
+        fTotal = max(fStages + fOther, 1e-9)
+
+        print(f'Load time     - {fElapsed:.2f}s, {iRows / max(fElapsed, 1e-9):,.0f} rows/s, {self.iBytesRead / 1048576:,.1f} MB read')
+        for sStage in lLoadStages + ['other']:
+            fSeconds = fOther if sStage == 'other' else self.dSeconds.get(sStage)
+            if fSeconds is not None:
+                print(f'    {sStage:<9} - {fSeconds:.2f}s ({fSeconds / fTotal:.0%})')
+
+
+class BatchWriter:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Collects the insert and update rows of a table load and writes them to the database in executemany() batches.
+    #   The caller owns the transaction, the writer commits it every iCommitRows rows written (0 means only the caller commits, at the end).
+    #   iRowsChanged is the number of table rows the statements actually changed. The time writing is counted in oStats if given.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    def __init__(self, oDB: Database, sInsertSQL: str, sUpdateSQL: str, iBatchSize: int = 5000, iCommitRows: int = 0, oStats: LoadStats = None) -> None:
+        self.oDB = oDB
+        self.sInsertSQL = sInsertSQL
+        self.sUpdateSQL = sUpdateSQL
+        self.iBatchSize = max(iBatchSize, 1)
+        self.iCommitRows = iCommitRows
+        self.lInsertRows = []
+        self.lUpdateRows = []
+        self.iRowsSinceCommit = 0
+        self.iRowsChanged = 0
+        self.oStats = oStats or LoadStats()
+
+    def insert(self, tData: tuple) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Queue a row for the insert statement
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.lInsertRows.append(tData)
+        self.__queued__()
+
+    def update(self, tData: tuple) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Queue a row for the update statement, the data tuple has the non key fields followed by the key fields
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.lUpdateRows.append(tData)
+        self.__queued__()
+
+    def __queued__(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine to write the batches once they are full or a commit is due
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.iRowsSinceCommit += 1
+
+        if self.iCommitRows and self.iRowsSinceCommit >= self.iCommitRows:
+            self.flush()
+            with self.oStats.stage('write'):
+                self.oDB.commitTransaction(bEnd=False)
+            self.iRowsSinceCommit = 0
+        elif len(self.lInsertRows) + len(self.lUpdateRows) >= self.iBatchSize:
+            self.flush()
+
+    def flush(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Write out the queued rows, inserts go first as a later row in the file can update a key inserted earlier in the same batch
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        with self.oStats.stage('write'):
+            if self.lInsertRows:
+                self.iRowsChanged += self.oDB.executeMany(self.sInsertSQL, self.lInsertRows)
+                self.lInsertRows = []
+            if self.lUpdateRows:
+                self.iRowsChanged += self.oDB.executeMany(self.sUpdateSQL, self.lUpdateRows)
+                self.lUpdateRows = []
+
+    def queued(self) -> int:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns the number of rows waiting to be written
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        return len(self.lInsertRows) + len(self.lUpdateRows)
+
+
+def fetchKeyIndex(sTableName: str, lKeyFields: list, sFindField: str) -> dict:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Read every key in the table in one pass and return a {(key values): find field value} dictionary.
+    #   The key values are in the order of lKeyFields. Where a key is in the table more than once the first row is used.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    iKeys = len(lKeyFields)
+    dIndex = {}
+    for tRow in oDatabase.fetchIter(f"SELECT {', '.join(lKeyFields)}, {sFindField} FROM {sTableName}", iArraySize=5000):
+        dIndex.setdefault(tuple(tRow[:iKeys]), tRow[iKeys])
 
-    sUpdateSQL += (', '.join(lUpdateFields) + ' WHERE ' + ' AND '.join(lKeyPredicates))
-    # print(sUpdateSQL)
+    return dIndex
 
-    iInsertCount = 0
-    iUpdateCount = 0
-    iIgnoreCount = 0
 
-    oUpdateField = None
+def fileFingerprint(sFile: str) -> str:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the SHA-256 of the file contents, read in 1MB blocks
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    oHash = hashlib.sha256()
+    with open(sFile, mode='rb') as oFile:
+        for bBlock in iter(lambda: oFile.read(1024 * 1024), b''):
+            oHash.update(bBlock)
+    return oHash.hexdigest()
 
-    for iRow, lData in enumerate(lDataList):
-        # ignore the first row as it's the field names
-        if iRow > 0:
-            # convert all the date fields in the list
-            lFields = list(convertField(field) for field in lData)
 
-            tKeyFields = tuple(field for iCtr, field in enumerate(lFields) if iCtr in lKeyColumnNumbers)
+def fileLoadedOn(sTableName: str, sFingerprint: str) -> Union[str, None]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns when a file with this fingerprint was loaded into the table, or None if it never has been
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    if not oDatabase.fetchValue("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'LoadedFile'"):
+        return None
+    return oDatabase.fetchValue("SELECT Loaded FROM LoadedFile WHERE TableName = ? AND Fingerprint = ?", (sTableName, sFingerprint))
 
-            iCount = oDatabase.fetchValue(sCountSQL, tKeyFields)
-            oField = oDatabase.fetchValue(sFindSQL, tKeyFields)
 
-            if iUpdateColumnFieldNumber:
-                oUpdateField = lFields[iUpdateColumnFieldNumber]
+def rowFingerprint(lFields) -> str:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the content hash for a converted row
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    return hashlib.blake2b('\x1f'.join(lFields).encode(), digest_size=16).hexdigest()
 
-            if iCount == 0:
-                # create the tuple for the insert statement
-                tInsertFields = tuple(lFields)
-                # print(f"Field value in row {iRow} is {tKeyFields}, needs to be inserted into database.")
 
-                oDatabase.execute(sInsertSQL, tInsertFields)
-                iInsertCount += 1
-            elif oField == oUpdateField:
-                # print(f"Field value in row {iRow} is {tKeyFields}, data is the same")
-                iIgnoreCount += 1
+class TableLoader:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Loads converted CSV rows into one table. The header is given when the loader is created, batches of converted rows are pushed in with
+    #   addRows() and finish() completes the load. The caller owns the transaction, which must be started before start() is called.
+    #   sLoadMode 'upsert' has SQLite merge the rows on the table's unique key, 'classify' decides insert/update/ignore in Python and
+    #   'staging' copies the rows into a TEMP table and merges it with a few set based statements.
+    #   'incremental' only writes rows whose content hash differs from the one recorded when the key was last loaded, whatever column changed.
+    #   The other modes don't keep the row hashes, so they clear them for the table. sFingerprint, if given, is recorded in LoadedFile.
+    #   The stage times go into oStats, and if a progress bar container is running (GlobalVars.oProgress) the load has a bar of its own.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    def __init__(self, sTableName: str, tFieldNames, iBatchSize: int = 5000, iCommitRows: int = 0, sLoadMode: str = 'upsert',
+                 sFingerprint: str = '', sFileName: str = '', oStats: LoadStats = None) -> None:
+        self.sTableName = sTableName
+        self.sLoadMode = sLoadMode
+        self.sFingerprint = sFingerprint
+        self.sFileName = sFileName
+        self.iBatchSize = iBatchSize
+        self.iCommitRows = iCommitRows
+
+        self.iInsertCount = 0
+        self.iUpdateCount = 0
+        self.iIgnoreCount = 0
+        self.iRejectCount = 0
+        self.iRowCount = 0
+
+        self.oStats = oStats or LoadStats()
+        self.iProgressTask = None
+        self.iMaxRowIDBefore = 0
+
+        self.lTableKeyFields = tableKeyFields(sTableName)
+        self.sUpdateField = tableUpdateField(sTableName)
+        self.lInsertFields = []
+        self.lKeyColumnNames = []
+        self.lKeyColumnNumbers = []
+        self.iUpdateColumnFieldNumber = None
+
+        lUpdateFields = []
+        lUpsertFields = []
+        lKeyPredicates = []
+
+        for iField, sField in enumerate(tFieldNames):
+            sDBFieldName = dFieldTranslations[sTableName][sField.replace('.', '_')]
+            self.lInsertFields.append(sDBFieldName)
+            if sDBFieldName in self.lTableKeyFields:
+                self.lKeyColumnNumbers.append(iField)
+                self.lKeyColumnNames.append(sDBFieldName)
+                lKeyPredicates.append(f'{sDBFieldName} = ?')
             else:
-                # print(f"Field value in row {iRow} is {tKeyFields}, value is {oField}, new value is {oUpdateField}.")
-                tUpdateFields = (tuple(field for iCtr, field in enumerate(lFields) if iCtr not in lKeyColumnNumbers))
-                tUpdateFields += tKeyFields
+                lUpdateFields.append(f'{sDBFieldName} = ?')
+                lUpsertFields.append(f'{sDBFieldName} = excluded.{sDBFieldName}')
+
+            if sDBFieldName == self.sUpdateField:
+                self.iUpdateColumnFieldNumber = iField
+
+        self.sInsertSQL = f"INSERT INTO {sTableName} ({', '.join(self.lInsertFields)}) VALUES ({', '.join(['?'] * len(self.lInsertFields))})"
+        # print(self.sInsertSQL)
+
+        self.sUpdateSQL = f"UPDATE {sTableName} SET {', '.join(lUpdateFields)} WHERE {' AND '.join(lKeyPredicates)}"
+        # print(self.sUpdateSQL)
+
+        # upsert lets SQLite do the merge against the unique key index, only rows with a different update field value are rewritten
+        self.sUpsertSQL = f"{self.sInsertSQL} ON CONFLICT ({', '.join(self.lTableKeyFields)}) DO UPDATE SET {', '.join(lUpsertFields)}"
+        if self.sUpdateField in self.lInsertFields:
+            self.sUpsertSQL += f" WHERE excluded.{self.sUpdateField} IS NOT {sTableName}.{self.sUpdateField}"
+        # print(self.sUpsertSQL)
+
+        # incremental rewrites every changed row whole, whatever its update field says
+        self.sIncrementalSQL = f"{self.sInsertSQL} ON CONFLICT ({', '.join(self.lTableKeyFields)}) DO UPDATE SET {', '.join(lUpsertFields)}"
+
+        # the comments of the tickets in the file are parsed into TicketEvent once the rows are in
+        self.iNumberColumn = self.lInsertFields.index('Number') if sTableName in ['Incident', 'Request'] and 'CommentsAndWorkNotes' in self.lInsertFields else None
+        self.lNumbers = []
+        self.iEventCount = 0
+
+        self.sStageTable = f"temp.Staging{sTableName}"
+        self.oWriter = None
+        self.oHashWriter = None
+        self.dKeyIndex = None
+        self.dRowHashes = None
+        self.iRowsBefore = 0
+
+    def start(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Prepare the table for the load, depending on the load mode
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.oStats.fStarted = perf_counter()
+        if GlobalVars.oProgress is not None:
+            iFileSize = os.path.getsize(self.sFileName) if self.sFileName and os.path.isfile(self.sFileName) else None
+            self.iProgressTask = out.createProgressTask(f"Loading {self.sTableName}", total=iFileSize, status='')
+
+        # classify updates rows by key, so it needs an index on the key too, but doesn't rely on it being unique
+        createKeyIndex(oDatabase, self.sTableName, bUnique=self.sLoadMode in ['upsert', 'staging', 'incremental'])
+
+        createLoadTables(oDatabase)
+        if self.sLoadMode != 'incremental':
+            oDatabase.execute("DELETE FROM RowFingerprint WHERE TableName = ?", (self.sTableName,))
+
+        if self.sLoadMode in ['upsert', 'incremental']:
+            # while the load runs, the rows inserted so far are how far the table's rowid has gone past where it started
+            self.iMaxRowIDBefore = oDatabase.fetchValue(f"SELECT COALESCE(MAX(rowid), 0) FROM {self.sTableName}")
+
+        if self.sLoadMode == 'incremental':
+            self.iRowsBefore = oDatabase.fetchValue(f"SELECT COUNT(*) FROM {self.sTableName}")
+            with self.oStats.stage('lookup'):
+                self.dRowHashes = dict(oDatabase.fetchList("SELECT RowKey, Hash FROM RowFingerprint WHERE TableName = ?", (self.sTableName,)))
+            self.oWriter = BatchWriter(oDatabase, self.sIncrementalSQL, self.sUpdateSQL, self.iBatchSize, self.iCommitRows, self.oStats)
+            self.oHashWriter = BatchWriter(oDatabase, "INSERT INTO RowFingerprint (TableName, RowKey, Hash) VALUES (?, ?, ?) "
+                                                      "ON CONFLICT (TableName, RowKey) DO UPDATE SET Hash = excluded.Hash", '', self.iBatchSize,
+                                           oStats=self.oStats)
+
+        elif self.sLoadMode == 'staging':
+            # the staging table takes its column affinities from the real table
+            sFields = ', '.join(self.lInsertFields)
+            oDatabase.execute(f"DROP TABLE IF EXISTS {self.sStageTable}")
+            oDatabase.execute(f"CREATE TEMP TABLE Staging{self.sTableName} AS SELECT {sFields} FROM main.{self.sTableName} WHERE 0")
+            oDatabase.execute(f"ALTER TABLE {self.sStageTable} ADD COLUMN LoadAction TEXT DEFAULT 'insert'")
+            self.oWriter = BatchWriter(oDatabase, f"INSERT INTO {self.sStageTable} ({sFields}) VALUES ({', '.join(['?'] * len(self.lInsertFields))})", '',
+                                       self.iBatchSize, oStats=self.oStats)
+
+        elif self.sLoadMode == 'upsert':
+            # the insert and update counts come from the rows changed and how much the table has grown
+            self.iRowsBefore = oDatabase.fetchValue(f"SELECT COUNT(*) FROM {self.sTableName}")
+            self.oWriter = BatchWriter(oDatabase, self.sUpsertSQL, self.sUpdateSQL, self.iBatchSize, self.iCommitRows, self.oStats)
 
-                oDatabase.execute(sUpdateSQL, tUpdateFields)
-                iUpdateCount += 1
+        else:
+            # rows are classified against an index of the keys already in the table, rather than a lookup query per row
+            with self.oStats.stage('lookup'):
+                if self.iUpdateColumnFieldNumber:
+                    self.dKeyIndex = fetchKeyIndex(self.sTableName, self.lKeyColumnNames, self.sUpdateField)
+                else:
+                    self.dKeyIndex = fetchKeyIndex(self.sTableName, self.lKeyColumnNames, self.lTableKeyFields[0])
+            self.oWriter = BatchWriter(oDatabase, self.sInsertSQL, self.sUpdateSQL, self.iBatchSize, self.iCommitRows, self.oStats)
+
+    def addRows(self, iterFields) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Load the converted rows, these are queued in the batch writer and written once a batch is full.
+        #   With upsert and staging SQLite does the key lookup as it writes, so all the loop's time is write time.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        iterFields = self.__checkRows__(iterFields)
+        if self.iNumberColumn is not None:
+            iterFields = self.__noteNumbers__(iterFields)
+        if self.iProgressTask is not None:
+            iterFields = self.__trackProgress__(iterFields)
+
+        if self.sLoadMode in ['upsert', 'staging']:
+            with self.oStats.stage('write'):
+                for lFields in iterFields:
+                    self.oWriter.insert(tuple(lFields))
+                    self.iRowCount += 1
+
+        elif self.sLoadMode == 'incremental':
+            with self.oStats.stage('lookup'):
+                for lFields in iterFields:
+                    sRowKey = '\x1f'.join([lFields[iField] for iField in self.lKeyColumnNumbers])
+                    sHash = rowFingerprint(lFields)
+                    if self.dRowHashes.get(sRowKey) == sHash:
+                        self.iIgnoreCount += 1
+                    else:
+                        self.dRowHashes[sRowKey] = sHash
+                        self.oWriter.insert(tuple(lFields))
+                        self.oHashWriter.insert((self.sTableName, sRowKey, sHash))
+                    self.iRowCount += 1
+
+        else:
+            with self.oStats.stage('lookup'):
+                for sAction, tData in classifyRows(iterFields, self.dKeyIndex, self.lKeyColumnNumbers, self.iUpdateColumnFieldNumber):
+                    if sAction == 'insert':
+                        self.oWriter.insert(tData)
+                        self.iInsertCount += 1
+                    elif sAction == 'update':
+                        self.oWriter.update(tData)
+                        self.iUpdateCount += 1
+                    else:
+                        self.iIgnoreCount += 1
+                    self.iRowCount += 1
+
+    def __checkRows__(self, iterFields):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal generator that passes the rows through, erroring on a blank or short (or long) row as its fields can't be matched to the columns
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        iColumns = len(self.lInsertFields)
+        for iRow, lFields in enumerate(iterFields, self.iRowCount + 1):
+            if len(lFields) != iColumns:
+                raise DatabaseError(f"Row {iRow} of the {self.sTableName} file{f' {self.sFileName}' if self.sFileName else ''} has {len(lFields)} fields, "
+                                    f"the header has {iColumns}.")
+            yield lFields
+
+    def __noteNumbers__(self, iterFields):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal generator that passes the rows through, remembering the ticket numbers
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        for lFields in iterFields:
+            self.lNumbers.append(lFields[self.iNumberColumn])
+            yield lFields
+
+    def __trackProgress__(self, iterFields):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal generator that passes the rows through, refreshing the progress bar every 1000 rows
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        for lFields in iterFields:
+            yield lFields
+            if not self.iRowCount % 1000:
+                self.showProgress()
+
+    def liveCounts(self) -> tuple[int, int, int]:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns the (inserted, updated, ignored) counts so far, while the load is running. For upsert and incremental the rows written are
+        #   split using the growth of the table's rowid. Staged rows aren't classified until the merge, so staging has nothing to show until then.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        if self.sLoadMode == 'classify':
+            return self.iInsertCount, self.iUpdateCount, self.iIgnoreCount
+        if self.sLoadMode == 'staging':
+            return 0, 0, 0
+
+        iInserted = oDatabase.fetchValue(f"SELECT COALESCE(MAX(rowid), 0) FROM {self.sTableName}") - self.iMaxRowIDBefore
+        iUpdated = self.oWriter.iRowsChanged - iInserted
+        if self.sLoadMode == 'incremental':
+            return iInserted, iUpdated, self.iIgnoreCount
+        return iInserted, iUpdated, self.iRowCount - self.oWriter.queued() - self.oWriter.iRowsChanged
+
+    def showProgress(self, bFinal: bool = False) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Refresh the progress bar with the rows/second, bytes read and the insert/update/ignore split, the final counts once finished
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        if self.iProgressTask is None:
+            return
+
+        if bFinal:
+            iInserted, iUpdated, iIgnored = self.iInsertCount, self.iUpdateCount, self.iIgnoreCount
+        else:
+            iInserted, iUpdated, iIgnored = self.liveCounts()
+
+        if self.sLoadMode == 'staging' and not bFinal:
+            sSplit = f"{self.iRowCount:,} staged"
+        else:
+            sSplit = f"{iInserted:,} inserted, {iUpdated:,} updated, {iIgnored:,} ignored"
+
+        out.updateProgressTask(self.iProgressTask, completed=self.oStats.iBytesRead,
+                               status=f"{self.iRowCount:,} rows, {self.iRowCount / max(self.oStats.elapsed(), 1e-9):,.0f} rows/s, "
+                                      f"{self.oStats.iBytesRead / 1048576:,.1f} MB, {sSplit}")
+
+    def finish(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Write out the last batch, merge the staged rows if staging, and work out the counts
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.oWriter.flush()
+
+        if self.sLoadMode == 'staging':
+            with self.oStats.stage('write'):
+                self.__mergeStagedRows__()
+        else:
+            if self.sLoadMode == 'upsert':
+                self.iInsertCount = oDatabase.fetchValue(f"SELECT COUNT(*) FROM {self.sTableName}") - self.iRowsBefore
+                self.iUpdateCount = self.oWriter.iRowsChanged - self.iInsertCount
+                self.iIgnoreCount = self.iRowCount - self.oWriter.iRowsChanged
+            elif self.sLoadMode == 'incremental':
+                self.oHashWriter.flush()
+                self.iInsertCount = oDatabase.fetchValue(f"SELECT COUNT(*) FROM {self.sTableName}") - self.iRowsBefore
+                self.iUpdateCount = self.oWriter.iRowsChanged - self.iInsertCount
+
+            if self.sTableName in ['Incident', 'Request']:
+                sSQL = f"UPDATE {self.sTableName} SET ReportPriority = Priority WHERE ReportPriority IS NULL"
+                with self.oStats.stage('write'):
+                    oDatabase.execute(sSQL, ())
+
+        if self.iNumberColumn is not None:
+            with self.oStats.stage('events'):
+                self.iEventCount = refreshTicketEvents(self.sTableName, list(dict.fromkeys(self.lNumbers)))
+
+        if self.sFingerprint:
+            oDatabase.execute("INSERT OR REPLACE INTO LoadedFile (TableName, Fingerprint, FileName, Rows, Loaded) VALUES (?, ?, ?, ?, ?)",
+                              (self.sTableName, self.sFingerprint, self.sFileName, self.iRowCount, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+        self.oStats.fFinished = perf_counter()
+        self.showProgress(bFinal=True)
+
+    def __mergeStagedRows__(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine to validate the staged rows and merge them into the table with set based statements.
+        #   Rows with a blank key are rejected, and where the file has a key more than once the last row wins (the earlier ones count as ignored).
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        sTableName = self.sTableName
+        sStageTable = self.sStageTable
+        sFields = ', '.join(self.lInsertFields)
+        sKeyFields = ', '.join(self.lTableKeyFields)
+        sKeyJoin = ' AND '.join([f"{sTableName}.{sField} = Stage.{sField}" for sField in self.lTableKeyFields])
+
+        # validation, rows without a complete key can't be matched or inserted
+        oDatabase.execute(f"DELETE FROM {sStageTable} WHERE " + ' OR '.join([f"COALESCE({sField}, '') = ''" for sField in self.lTableKeyFields]))
+        self.iRejectCount = oDatabase.oDBCursor.rowcount
+        oDatabase.execute(f"DELETE FROM {sStageTable} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {sStageTable} GROUP BY {sKeyFields})")
+        iDuplicateCount = oDatabase.oDBCursor.rowcount
+        oDatabase.execute(f"CREATE UNIQUE INDEX temp.IX_Staging{sTableName}_Key ON Staging{sTableName} ({sKeyFields})")
+
+        # classify the staged rows against the table in one statement
+        if self.sUpdateField in self.lInsertFields:
+            sAction = f"CASE WHEN {sTableName}.{self.sUpdateField} IS Stage.{self.sUpdateField} THEN 'ignore' ELSE 'update' END"
+        else:
+            sAction = "'update'"
+        oDatabase.execute(f"UPDATE {sStageTable} AS Stage SET LoadAction = {sAction} FROM main.{sTableName} WHERE {sKeyJoin}")
+
+        # and merge them in
+        sSetFields = ', '.join([f"{sField} = Stage.{sField}" for sField in self.lInsertFields if sField not in self.lTableKeyFields])
+        oDatabase.execute(f"UPDATE main.{sTableName} SET {sSetFields} FROM {sStageTable} AS Stage WHERE Stage.LoadAction = 'update' AND {sKeyJoin}")
+        oDatabase.execute(f"INSERT INTO main.{sTableName} ({sFields}) SELECT {sFields} FROM {sStageTable} WHERE LoadAction = 'insert'")
+
+        # only the new rows need their report priority set
+        if sTableName in ['Incident', 'Request']:
+            oDatabase.execute(f"UPDATE main.{sTableName} SET ReportPriority = Priority WHERE ReportPriority IS NULL AND "
+                              f"Number IN (SELECT Number FROM {sStageTable} WHERE LoadAction = 'insert')")
+
+        dCounts = dict(oDatabase.fetchList(f"SELECT LoadAction, COUNT(*) FROM {sStageTable} GROUP BY LoadAction"))
+        oDatabase.execute(f"DROP TABLE {sStageTable}")
+
+        self.iInsertCount = dCounts.get('insert', 0)
+        self.iUpdateCount = dCounts.get('update', 0)
+        self.iIgnoreCount = dCounts.get('ignore', 0) + iDuplicateCount
+
+    def printCounts(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Print the number of rows inserted, updated, ignored and rejected
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        print(f'Rows inserted - {self.iInsertCount}')
+        print(f'Rows updated  - {self.iUpdateCount}')
+        print(f'Rows ignored  - {self.iIgnoreCount}')
+        if self.iRejectCount:
+            print(f'Rows rejected - {self.iRejectCount} (blank key)')
+        if self.iEventCount:
+            print(f'Tickets with comments parsed - {self.iEventCount}')
+
+    def printTimings(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Print the time the load took and the breakdown by stage
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.oStats.printTimings(self.iRowCount)
+
+
+def loadTableToDatabase(sTableName, iterRows, iBatchSize=5000, iCommitRows=0, sLoadMode='upsert', sFingerprint='', sFileName='', oStats=None):
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Load the CSV rows into the table. The rows are streamed through read -> convert -> classify -> batch write,
+    #   so only the key index and one batch of rows are held in memory. The first row has the field names.
+    #   Progress is shown as the load runs and the time taken by each stage printed at the end. oStats is the LoadStats the reader was given.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    oStats = oStats or LoadStats()
+    iterRows = iter(iterRows)
+    tFieldNames = next(iterRows, None)
+    if tFieldNames is None:
+        print(f'File for table {sTableName} is empty, nothing to load.')
+        return
+
+    # all the rows are loaded in one transaction, so a failure part way through leaves the table as it was (or as at the last commit)
+    GlobalVars.oProgress = out.createProgressBars('status')
+    with GlobalVars.oProgress:
+        oLoader = TableLoader(sTableName, tFieldNames, iBatchSize, iCommitRows, sLoadMode, sFingerprint, sFileName, oStats)
+
+        with oDatabase.transaction():
+            oLoader.start()
+            oLoader.addRows(oStats.timeIter('convert', convertRows(tFieldNames, oStats.timeIter('parse', iterRows))))
+            oLoader.finish()
+
+    oLoader.printCounts()
+    oLoader.printTimings()
+
+
+def batchRows(iterRows, iBatchSize: int):
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Generator that groups the rows into lists of up to iBatchSize rows
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    iterRows = iter(iterRows)
+    lBatch = list(islice(iterRows, iBatchSize))
+    while lBatch:
+        yield lBatch
+        lBatch = list(islice(iterRows, iBatchSize))
 
-    print(f'Rows inserted - {iInsertCount}')
-    print(f'Rows updated  - {iUpdateCount}')
-    print(f'Rows ignored  - {iIgnoreCount}')
 
-    if oArgs.table in ['Incident', 'Request']:
-        sSQL = f"UPDATE {oArgs.table} SET ReportPriority = Priority WHERE ReportPriority IS NULL"
-        oDatabase.execute(sSQL, ())
+def parseCSVFileToQueue(iLoad: int, sFile: str, sEncoding: str, iBatchSize: int, oQueue, oStop) -> None:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Worker process for the multi file loader. Reads and converts the CSV file and puts (load number, kind, data) messages on the queue:
+    #   'header' with the field names, 'rows' with each batch of converted rows and the bytes read so far, then 'end' with the parse and
+    #   convert times, or 'error' with the message if the file can't be read. If the writer sets oStop the file is abandoned and 'end' is sent straight away.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    try:
+        oStats = LoadStats()
+        iterRows = readCSVFile(sFile, encoding=sEncoding, oStats=oStats)
+        tFieldNames = next(iterRows, None)
+        if tFieldNames is not None and not oStop.is_set():
+            oQueue.put((iLoad, 'header', tFieldNames))
+            for lBatch in batchRows(oStats.timeIter('convert', convertRows(tFieldNames, oStats.timeIter('parse', iterRows))), iBatchSize):
+                if oStop.is_set():
+                    break
+                oQueue.put((iLoad, 'rows', (lBatch, oStats.iBytesRead)))
+        oQueue.put((iLoad, 'end', oStats.dSeconds))
+
+    except Exception as exp:
+        # anything at all must be reported, otherwise the writer waits forever for the end of this file
+        oQueue.put((iLoad, 'error', f"{type(exp).__name__}: {exp}"))
+
+
+def resolveLoadFiles(lLoadSpecs: list) -> list[tuple[str, str]]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Turn the 'table=file', directory and glob arguments into a list of (table, file) pairs.
+    #   For a directory or glob the table comes from the file name, e.g. 'IncidentSLA_March.csv' loads IncidentSLA.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    lLoads = []
+    for sSpec in lLoadSpecs:
+        if '=' in sSpec:
+            sTableName, sFile = sSpec.split('=', 1)
+            lLoads.append((sTableName, sFile))
+            continue
+
+        lFiles = sorted(glob.glob(os.path.join(sSpec, '*.csv'))) if os.path.isdir(sSpec) else sorted(glob.glob(sSpec))
+        if not lFiles:
+            raise DatabaseError(f"No files found for '{sSpec}'.")
+
+        for sFile in lFiles:
+            sFileName = flatten(os.path.splitext(os.path.basename(sFile))[0])
+            lTables = [sTableName for sTableName in dFieldTranslations if sFileName.startswith(flatten(sTableName))]
+            if not lTables:
+                raise DatabaseError(f"Cannot tell which table file '{sFile}' is for.")
+            lLoads.append((max(lTables, key=len), sFile))
+
+    lTables = [sTableName for sTableName, _sFile in lLoads]
+    for sTableName in lTables:
+        if sTableName not in dFieldTranslations:
+            raise DatabaseError(f"Table '{sTableName}' is not a table that can be loaded.")
+        if lTables.count(sTableName) > 1:
+            raise DatabaseError(f"Table '{sTableName}' has more than one file to load.")
+
+    return lLoads
+
+
+def loadDatabaseFiles(lLoads: list, iBatchSize=5000, iCommitRows=0, sLoadMode='upsert', iWorkers=None, iQueueBatches=16, sEncoding='ISO-8859-1',
+                      bForce=False):
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Load several (table, file) pairs at once. The files are read and converted in a process pool and the batches are fed through a bounded
+    #   queue to this process, which is the only one writing to the database. All the files are loaded in the one transaction.
+    #   A file already loaded into its table (same fingerprint) is skipped unless bForce is set. Each file has a progress bar while it loads.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    dLoaders = {}
+
+    GlobalVars.oProgress = out.createProgressBars('status')
+    with GlobalVars.oProgress, Manager() as oManager, ProcessPoolExecutor(max_workers=iWorkers or min(len(lLoads), os.cpu_count() or 1)) as oPool:
+        lFingerprints = list(oPool.map(fileFingerprint, [sFile for _sTableName, sFile in lLoads]))
+        lSkipped = [] if bForce else [iLoad for iLoad, (sTableName, _sFile) in enumerate(lLoads) if fileLoadedOn(sTableName, lFingerprints[iLoad])]
+        iOpenLoads = len(lLoads) - len(lSkipped)
+
+        oQueue = oManager.Queue(maxsize=iQueueBatches)
+        oStop = oManager.Event()
+        for iLoad, (_sTableName, sFile) in enumerate(lLoads):
+            if iLoad not in lSkipped:
+                oPool.submit(parseCSVFileToQueue, iLoad, sFile, sEncoding, iBatchSize, oQueue, oStop)
+
+        oDatabase.beginTransaction()
+        try:
+            while iOpenLoads:
+                iLoad, sKind, oData = oQueue.get()
+                sTableName, sFile = lLoads[iLoad]
+
+                if sKind == 'header':
+                    dLoaders[iLoad] = TableLoader(sTableName, oData, iBatchSize, iCommitRows, sLoadMode, lFingerprints[iLoad], sFile)
+                    dLoaders[iLoad].start()
+                elif sKind == 'rows':
+                    lBatch, dLoaders[iLoad].oStats.iBytesRead = oData
+                    dLoaders[iLoad].addRows(lBatch)
+                elif sKind == 'end':
+                    iOpenLoads -= 1
+                    if iLoad in dLoaders:
+                        dLoaders[iLoad].oStats.addSeconds(oData)
+                        dLoaders[iLoad].finish()
+                else:
+                    iOpenLoads -= 1
+                    raise DatabaseError(f"File '{sFile}' for table {sTableName} could not be read, {oData}")
+
+            oDatabase.commitTransaction()
+
+        except BaseException:
+            # whatever went wrong (a bad row, Ctrl-C), nothing is kept and the workers are stopped, and the queue drained so none of them is left
+            # blocked on a full queue, otherwise the pool waits for them forever
+            oDatabase.rollbackTransaction()
+            oStop.set()
+            while iOpenLoads:
+                if oQueue.get()[1] in ['end', 'error']:
+                    iOpenLoads -= 1
+            raise
+
+    for iLoad, (sTableName, sFile) in enumerate(lLoads):
+        print(f"{sTableName} from {sFile}")
+        if iLoad in lSkipped:
+            print(f"File was already loaded on {fileLoadedOn(sTableName, lFingerprints[iLoad])}, skipped.")
+        elif iLoad in dLoaders:
+            dLoaders[iLoad].printCounts()
+            dLoaders[iLoad].printTimings()
+        else:
+            print('File is empty, nothing to load.')
 
 
 def mapService(sService) -> str:
@@ -388,6 +1151,14 @@ def stripColours(sText) -> str:
     return sText.replace('[green]', '').replace('[red]', '').replace('[orange3]', '').replace('[yellow]', '').replace('[white]', '')
 
 
+def copyToClipboard(oReport: Report) -> None:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Copy the report table to the clipboard, unless that has been turned off (GlobalVars.bClipboard)
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    if GlobalVars.bClipboard:
+        oReport.sendToClipboard()
+
+
 def ServiceNOWReports():
     dtStartOfMonth = dtEndOfMonth = None
     lTeam_HV = ['Shagufta Anjum Shaik', 'Marwa Elshawy', 'Siddhartha Dutta', 'Mathieu Doumerc', "Keith D'Souza", 'Wilson Lee', 'Wayne Moss']
@@ -395,17 +1166,18 @@ def ServiceNOWReports():
     sDateTimeFormat = '%Y-%m-%d %H:%M:%S'
 
     if oArgs.month:
-        iLastDay = calendar.monthrange(2024, oArgs.month)[1]
-        dtStartOfMonth = datetime.strptime(f"2024-{oArgs.month}-01 00:00:00", sDateTimeFormat)
-        dtEndOfMonth = datetime.strptime(f"2024-{oArgs.month}-{iLastDay} 23:59:59", sDateTimeFormat)
+        iLastDay = calendar.monthrange(oArgs.year, oArgs.month)[1]
+        dtStartOfMonth = datetime.strptime(f"{oArgs.year}-{oArgs.month}-01 00:00:00", sDateTimeFormat)
+        dtEndOfMonth = datetime.strptime(f"{oArgs.year}-{oArgs.month}-{iLastDay} 23:59:59", sDateTimeFormat)
 
     if oArgs.report == 1:
         lRespondedCount = [0, 0, 0, 0, 0]
         lResolvedCount = [0, 0, 0, 0, 0]
 
         # ---------- Incident response and resolution------------
-        sSQL = ("SELECT ReportingService, Number, State, Priority, ReportPriority, AssignedTo, ShortDescription, Opened, Resolved, CommentsAndWorkNotes, Notes, Caller "
-                "FROM Incident WHERE ReportingService <> 'Other' AND Exclude = ? AND State <> 'Cancelled' AND Updated > ? ORDER BY ReportingService, ReportPriority, Number")
+        sWhere = "ReportingService <> 'Other' AND Exclude = ? AND State <> 'Cancelled' AND Updated > ?"
+        sSQL = ("SELECT ReportingService, Number, State, Priority, ReportPriority, AssignedTo, ShortDescription, Opened, Resolved, Notes, Caller "
+                f"FROM Incident WHERE {sWhere} ORDER BY ReportingService, ReportPriority, Number")
 
         oReport = Report(f'Incident Response and Resolution')
         oReport.addColumn('#', sJust='right')
@@ -442,17 +1214,17 @@ def ServiceNOWReports():
         oReportXL.addColumn('Notes', sJust='left')
 
         tData = (1 if oArgs.exclude else 0, dtStartOfMonth)
-        lResults = oDatabase.fetchList(sSQL, tData)
+        dSLAs = fetchIncidentSLAs(sWhere, tData)
+        dOverrides = fetchSLAOverrides('Incident', sWhere, tData)
+        dEvents = fetchTicketEventMap('Incident', sWhere, tData)
+        iterResults = oDatabase.fetchIter(sSQL, tData)
         iCtr = 0
 
-        lIncidentTargetResponseTimes = ['', '0:00:10', '0:00:30', '0:01:00', '0:04:00', '0:08:00']
-        lIncidentTargetResolveTimes = ['', '0:01:00', '0:04:00', '0:10:00', '5:00:00', '20:00:00']
-
         sPrevPriority = ' '   # must be one space not an empty string
         sPrevService = ''
 
-        for tResult in lResults:
-            sService, sNumber, sState, sPriority, sReportPriority, sAssignedTo, sDescription, sOpened, sResolved, sCommentsAndWorkNotes, sNotes, sCaller = tResult
+        for tResult in iterResults:
+            sService, sNumber, sState, sPriority, sReportPriority, sAssignedTo, sDescription, sOpened, sResolved, sNotes, sCaller = tResult
 
             sDescription = sDescription.replace('\t', ' ')
             if not sNotes:
@@ -471,10 +1243,9 @@ def ServiceNOWReports():
 
             iCtr = 1 if sReportPriority[0] != sPrevPriority[0] or sService != sPrevService else iCtr + 1
 
-            sOverrideSQL = "SELECT StartTime, EndTime FROM SLAOverride WHERE Number = ? AND SLA = 'Response'"
-            sResponseSQL = "SELECT StartTime, StopTime FROM IncidentSLA WHERE Number = ? AND SLADefinition = ?"
-            sSQLAnyResponse = "SELECT SLADefinition, StartTime, StopTime FROM IncidentSLA WHERE Number = ? AND SLADefinition LIKE '%Response'"
-            sSQLAnyResolve = "SELECT StartTime, StopTime FROM IncidentSLA WHERE Number = ? AND SLADefinition LIKE '%Resolution%'"
+            # the SLA records as reported by ServiceNOW, the definitions are matched ignoring case as LIKE did in the queries these replace
+            lSLAs = dSLAs.get(sNumber, [])
+            sResponseDefinition = f"P{sPriority[0]} Response"
 
             sResponded = "[yellow]      N/A"
             dtResponded = None
@@ -483,30 +1254,7 @@ def ServiceNOWReports():
             sRespondDuration = sResolveDuration = "[yellow]   N/A"
 
             # Work out the first touch time by someone in the team, and save the time before that it was touched, as that is when the SLA should start
-            dtFirstTeamTouch = None
-            dtReceiveNonTeamTouch = None
-
-            lOtherTeamTransfers = []
-            dtTeamTouch = dtOtherTeamTouch = None
-            for dtUpdate, sPerson, _sUpdateType, _sUpdateContent in parseCommentsAndWorkNotes(sCommentsAndWorkNotes):
-                if sPerson in lTeam_HV:
-                    if dtFirstTeamTouch is None:
-                        # this is the timestamp at which we have received the incident
-                        dtFirstTeamTouch = dtUpdate
-
-                    if dtOtherTeamTouch:
-                        # another team has been working on the incident, this time needs to be excluded
-                        lOtherTeamTransfers.append((dtTeamTouch, dtOtherTeamTouch))
-                        dtOtherTeamTouch = None
-                    dtTeamTouch = dtUpdate
-
-                elif sPerson not in lTeam_RBA:
-                    if dtFirstTeamTouch is None:
-                        # this is potentially the time as which we have received the incident, i.e. if helpdesk are updating it
-                        dtReceiveNonTeamTouch = dtUpdate
-                    else:
-                        # ITIMS HV team have updated the incident, now it's being updated by other teams, this incident has been transferred
-                        dtOtherTeamTouch = dtUpdate
+            dtFirstTeamTouch, dtReceiveNonTeamTouch, lOtherTeamTransfers = teamTouches(dEvents.get(sNumber, []), lTeam_HV, lTeam_RBA)
 
             # check to see whether a team member created the ticket, if so then it's an instance response and SLA met
             if sCaller in lTeam_HV:
@@ -523,22 +1271,22 @@ def ServiceNOWReports():
 
             else:
                 # get the actual SLA record as reported by ServiceNOW
-                lSLAResults = oDatabase.fetchList(sResponseSQL, (sNumber, f"P{sPriority[0]} Response"))
+                lSLAResults = [tSLA for tSLA in lSLAs if tSLA[0] == sResponseDefinition]
                 if lSLAResults:
-                    sSLAStartTime, sSLAStopTime = lSLAResults[0]
+                    _sSLADefinition, sSLAStartTime, sSLAStopTime = lSLAResults[0]
                     sReceivedSuffix = sRespondSuffix = ' (SLA)'
                 else:
                     # maybe there is a response under the original severity
-                    lSLAResults = oDatabase.fetchList(sSQLAnyResponse, (sNumber,))
+                    lSLAResults = [tSLA for tSLA in lSLAs if (tSLA[0] or '').lower().endswith('response')]
                     if lSLAResults:
                         sSLADefinition, sSLAStartTime, sSLAStopTime = lSLAResults[0]
                         sReceivedSuffix = sRespondSuffix = f'[orange3] ({sSLADefinition}) '
                         iOrigPriority = int(sSLADefinition[1])
                     else:
                         # get the SLA start time for the restore metric, this will most likely be the same time
-                        lSLAResults = oDatabase.fetchList(sSQLAnyResolve, (sNumber,))
+                        lSLAResults = [tSLA for tSLA in lSLAs if 'resolution' in (tSLA[0] or '').lower()]
                         if lSLAResults:
-                            sSLAStartTime, sSLAStopTime = lSLAResults[0]
+                            _sSLADefinition, sSLAStartTime, sSLAStopTime = lSLAResults[0]
                             sReceivedSuffix = '[orange3] (Resolve Start)'
                         else:
                             # last resort, use the open time, and the restore time, these might be good enough
@@ -551,9 +1299,8 @@ def ServiceNOWReports():
                     dtResponded = datetime.strptime(sSLAStopTime, sDateTimeFormat)
 
             # check if there's an SLA override
-            lSLAResults = oDatabase.fetchList(sOverrideSQL, (sNumber,))
-            if lSLAResults:
-                sStart, sEnd = lSLAResults[0]
+            if (sNumber, 'Response') in dOverrides:
+                sStart, sEnd = dOverrides[(sNumber, 'Response')]
                 if sStart:
                     dtReceived = datetime.strptime(sStart, sDateTimeFormat)
                     sReceivedSuffix = '[pink3] (o/ride)'
@@ -561,7 +1308,8 @@ def ServiceNOWReports():
                     dtResponded = datetime.strptime(sEnd, sDateTimeFormat)
                     sRespondSuffix = '[pink3] (o/ride)'
 
-            sResponseTarget = lIncidentTargetResponseTimes[iOrigPriority if iOrigPriority else int(sReportPriority[0])]
+            iResponsePriority = iOrigPriority if iOrigPriority else int(sReportPriority[0])
+            sResponseTarget = oSLAPolicies.target('Incident', 'Response', iResponsePriority, sService)
 
             # if the ticket has been received after the end of the month, then don't include
             if dtReceived and dtReceived > dtEndOfMonth:
@@ -575,7 +1323,7 @@ def ServiceNOWReports():
                 iDays, iHours, iMinutes = calculateBusinessTimeDiff(dtReceived, dtResponded)
                 sRespondTime = f"{iDays:2}:{iHours:02}:{iMinutes:02}"
 
-                dtSLABreachTime = calculateBusinessTimeDuration(dtReceived, sResponseTarget)
+                dtSLABreachTime = oSLAPolicies.breachTime(dtReceived, 'Incident', 'Response', iResponsePriority, sService)
 
                 if dtResponded > dtSLABreachTime:
                     sRespondDuration = '[red]' + sRespondTime
@@ -594,14 +1342,11 @@ def ServiceNOWReports():
                 sRespondDuration = "[yellow]  N/A"
 
             # ----- now work out the resolve time --------
-            sResolveTarget = lIncidentTargetResolveTimes[int(sReportPriority[0])]
-
-            sOverrideSQL = "SELECT EndTime FROM SLAOverride WHERE Number = ? AND SLA = 'Resolve'"
+            sResolveTarget = oSLAPolicies.target('Incident', 'Resolve', int(sReportPriority[0]), sService)
 
             # check if there's an SLA override
-            lSLAResults = oDatabase.fetchList(sOverrideSQL, (sNumber,))
-            if lSLAResults:
-                sEnd = lSLAResults[0][0]
+            if (sNumber, 'Resolve') in dOverrides:
+                sEnd = dOverrides[(sNumber, 'Resolve')][1]
                 print(f"Incident {sNumber} - sEnd {sEnd}")
                 dtResolved = datetime.strptime(sEnd, sDateTimeFormat)
                 sResolveSuffix = '[pink3] (o/ride)'
@@ -610,7 +1355,7 @@ def ServiceNOWReports():
                 iDays, iHours, iMinutes = calculateBusinessTimeDiff(dtReceived, dtResolved)
                 sResolveTime = f"{iDays:2}:{iHours:02}:{iMinutes:02}"
 
-                dtSLABreachTime = calculateBusinessTimeDuration(dtReceived, sResolveTarget)
+                dtSLABreachTime = oSLAPolicies.breachTime(dtReceived, 'Incident', 'Resolve', int(sReportPriority[0]), sService)
 
                 if dtResolved > dtSLABreachTime:
                     if lOtherTeamTransfers:
@@ -669,7 +1414,7 @@ def ServiceNOWReports():
         if oArgs.summary:
             oReportXL.printReport()
             print('')
-            oReportXL.sendToClipboard()
+            copyToClipboard(oReportXL)
 
         print(f"Respond counts {lRespondedCount}")
         print(f"Resolve counts {lResolvedCount}")
@@ -679,8 +1424,9 @@ def ServiceNOWReports():
         lResolvedCount = [0, 0, 0, 0, 0]
 
         # ---------- Request response and resolution------------
-        sSQL = ("SELECT Service, Number, RequestItem, Priority, ReportPriority, AssignedTo, ShortDescription, Opened, Closed, CommentsAndWorkNotes, Notes, RequestedBy "
-                "FROM Request WHERE Service <> 'Other' AND Exclude = ? AND Updated > ? ORDER BY Service, ReportPriority, Number")
+        sWhere = "Service <> 'Other' AND Exclude = ? AND Updated > ?"
+        sSQL = ("SELECT Service, Number, RequestItem, Priority, ReportPriority, AssignedTo, ShortDescription, Opened, Closed, Notes, RequestedBy "
+                f"FROM Request WHERE {sWhere} ORDER BY Service, ReportPriority, Number")
 
         oReport = Report(f'Request Response and Resolution')
         oReport.addColumn('#', sJust='right')
@@ -715,17 +1461,16 @@ def ServiceNOWReports():
         oReportXL.addColumn('Fulfillment Duration d:hh:mm', sJust='left')
 
         tData = (1 if oArgs.exclude else 0, dtStartOfMonth)
-        lResults = oDatabase.fetchList(sSQL, tData)
+        dOverrides = fetchSLAOverrides('Request', sWhere, tData)
+        dEvents = fetchTicketEventMap('Request', sWhere, tData)
+        iterResults = oDatabase.fetchIter(sSQL, tData)
         iCtr = 0
 
-        lRequestTargetResponseTimes = ['', '0:00:10', '0:00:30', '0:01:00', '0:04:00', '0:08:00']
-        lRequestTargetResolveTimes = ['', '0:02:00', '1:00:00', '5:00:00', '10:00:00', '260:00:00']
-
         sPrevPriority = ' '      # needs to be a single space not an empty string
         sPrevService = ''
 
-        for tResult in lResults:
-            sService, sNumber, sReqItem, sPriority, sReportPriority, sAssignedTo, sDescription, sOpened, sResolved, sCommentsAndWorkNotes, sNotes, sCaller = tResult
+        for tResult in iterResults:
+            sService, sNumber, sReqItem, sPriority, sReportPriority, sAssignedTo, sDescription, sOpened, sResolved, sNotes, sCaller = tResult
 
             if not sNotes:
                 sNotes = ''
@@ -741,8 +1486,6 @@ def ServiceNOWReports():
 
             iCtr = 1 if sReportPriority[0] != sPrevPriority[0] or sPrevService != sService else iCtr + 1
 
-            sOverrideSQL = "SELECT StartTime, EndTime FROM SLAOverride WHERE Number = ? AND SLA = 'Response'"
-
             sResponded = "[yellow]      N/A"
             dtResponded = None
             sRespondSuffix = ''
@@ -753,30 +1496,7 @@ def ServiceNOWReports():
             sRespondDuration = sResolveDuration = "[yellow]   N/A"
 
             # Work out the first touch time by someone in the team, and save the time before that it was touched, as that is when the SLA should start
-            dtFirstTeamTouch = None
-            dtReceiveNonTeamTouch = None
-
-            lOtherTeamTransfers = []
-            dtTeamTouch = dtOtherTeamTouch = None
-            for dtUpdate, sPerson, _sUpdateType, _sUpdateContent in parseCommentsAndWorkNotes(sCommentsAndWorkNotes):
-                if sPerson in lTeam_HV:
-                    if dtFirstTeamTouch is None:
-                        # this is the timestamp at which we have received the incident
-                        dtFirstTeamTouch = dtUpdate
-
-                    if dtOtherTeamTouch:
-                        # another team has been working on the incident, this time needs to be excluded
-                        lOtherTeamTransfers.append((dtTeamTouch, dtOtherTeamTouch))
-                        dtOtherTeamTouch = None
-                    dtTeamTouch = dtUpdate
-
-                elif sPerson not in lTeam_RBA:
-                    if dtFirstTeamTouch is None:
-                        # this is potentially the time as which we have received the incident, i.e. if helpdesk are updating it
-                        dtReceiveNonTeamTouch = dtUpdate
-                    else:
-                        # ITIMS HV team have updated the incident, now it's being updated by other teams, this incident has been transferred
-                        dtOtherTeamTouch = dtUpdate
+            dtFirstTeamTouch, dtReceiveNonTeamTouch, lOtherTeamTransfers = teamTouches(dEvents.get(sNumber, []), lTeam_HV, lTeam_RBA)
 
             # check to see whether a team member created the ticket, if so then it's an instance response and SLA met
             if sCaller in lTeam_HV:
@@ -798,9 +1518,8 @@ def ServiceNOWReports():
                 sRespondSuffix = '[orange3] (Touch)'
 
             # check if there's an SLA override
-            lSLAResults = oDatabase.fetchList(sOverrideSQL, (sNumber,))
-            if lSLAResults:
-                sStart, sEnd = lSLAResults[0]
+            if (sNumber, 'Response') in dOverrides:
+                sStart, sEnd = dOverrides[(sNumber, 'Response')]
                 if sStart:
                     dtReceived = datetime.strptime(sStart, sDateTimeFormat)
                     sReceivedSuffix = '[pink3] (o/ride)'
@@ -808,7 +1527,8 @@ def ServiceNOWReports():
                     dtResponded = datetime.strptime(sEnd, sDateTimeFormat)
                     sRespondSuffix = '[pink3] (o/ride)'
 
-            sResponseTarget = lRequestTargetResponseTimes[iOrigPriority if iOrigPriority else int(sReportPriority[0])]
+            iResponsePriority = iOrigPriority if iOrigPriority else int(sReportPriority[0])
+            sResponseTarget = oSLAPolicies.target('Request', 'Response', iResponsePriority, sService)
 
             # if the ticket has been received after the end of the month, then don't include
             if dtReceived and dtReceived > dtEndOfMonth:
@@ -822,7 +1542,7 @@ def ServiceNOWReports():
                 iDays, iHours, iMinutes = calculateBusinessTimeDiff(dtReceived, dtResponded)
                 sRespondTime = f"{iDays:2}:{iHours:02}:{iMinutes:02}"
 
-                dtSLABreachTime = calculateBusinessTimeDuration(dtReceived, sResponseTarget)
+                dtSLABreachTime = oSLAPolicies.breachTime(dtReceived, 'Request', 'Response', iResponsePriority, sService)
 
                 if dtResponded > dtSLABreachTime:
                     sRespondDuration = '[red]' + sRespondTime
@@ -845,13 +1565,13 @@ def ServiceNOWReports():
                 sResponded = f"[yellow]{sResponded}"
 
             # ----- now work out the resolve time --------
-            sResolveTarget = lRequestTargetResolveTimes[int(sReportPriority[0])]
+            sResolveTarget = oSLAPolicies.target('Request', 'Resolve', int(sReportPriority[0]), sService)
 
             if dtResolved and dtResolved < dtEndOfMonth:
                 iDays, iHours, iMinutes = calculateBusinessTimeDiff(dtReceived, dtResolved)
                 sResolveTime = f"{iDays:2}:{iHours:02}:{iMinutes:02}"
 
-                dtSLABreachTime = calculateBusinessTimeDuration(dtReceived, sResolveTarget)
+                dtSLABreachTime = oSLAPolicies.breachTime(dtReceived, 'Request', 'Resolve', int(sReportPriority[0]), sService)
 
                 if dtResolved > dtSLABreachTime:
                     if lOtherTeamTransfers:
@@ -901,7 +1621,7 @@ def ServiceNOWReports():
         if oArgs.summary:
             oReportXL.printReport()
             print("")
-            oReportXL.sendToClipboard()
+            copyToClipboard(oReportXL)
 
         print(f"Respond counts {lRespondedCount}")
         print(f"Resolve counts {lResolvedCount}")
@@ -919,9 +1639,9 @@ def ServiceNOWReports():
         oReport.addColumn('Summary', sJust='left')
         oReport.addColumn('Received', sJust='left')
 
-        lResults = oDatabase.fetchList(sSQL, ())
+        iterResults = oDatabase.fetchIter(sSQL, ())
         iCtr = 0
-        for tResult in lResults:
+        for tResult in iterResults:
             sService, sNumber, sState, sReportPriority, sDescription, sOpened, sResolved = tResult
 
             if sState in ('Closed', 'Resolved'):
@@ -940,7 +1660,7 @@ def ServiceNOWReports():
         oReport.showColumn(0, False)
         oReport.printReport()
         print("")
-        oReport.sendToClipboard()
+        copyToClipboard(oReport)
 
     if oArgs.report == 4:
         # ---------- Changes delivered ------------
@@ -967,9 +1687,9 @@ def ServiceNOWReports():
         oReportXL.addColumn('Environment', sJust='left')
         oReportXL.addColumn('Close Code', sJust='left')
 
-        lResults = oDatabase.fetchList(sSQL, (dtStartOfMonth, dtEndOfMonth))
+        iterResults = oDatabase.fetchIter(sSQL, (dtStartOfMonth, dtEndOfMonth))
         iCtr = 0
-        for tResult in lResults:
+        for tResult in iterResults:
             sService, sNumber, sDescription, sCategory, sClosedCode, sAssignedTo, sType, sEnvironment, bPlanned, sCategorisation, bProduction = tResult
 
             sDescription = sDescription.replace(' ', '')
@@ -992,7 +1712,7 @@ def ServiceNOWReports():
         print('')
         if oArgs.summary:
             oReportXL.printReport()
-            oReportXL.sendToClipboard()
+            copyToClipboard(oReportXL)
 
     if oArgs.report == 7:
         # ---------- History of ticket based on comments and work notes ------------
@@ -1001,11 +1721,13 @@ def ServiceNOWReports():
             exit(1)
 
         if oArgs.incident:
-            sSQL = "SELECT Created, Resolved, Closed, Caller, CommentsAndWorkNotes, Description FROM Incident WHERE Number = ?"
+            sSQL = "SELECT Created, Resolved, Closed, Caller, Description FROM Incident WHERE Number = ?"
             tData = (oArgs.incident, )
+            sTableName = 'Incident'
         else:
-            sSQL = "SELECT Opened, Closed, Closed, RequestedBy, CommentsAndWorkNotes, ShortDescription FROM Request WHERE Number = ?"
+            sSQL = "SELECT Opened, Closed, Closed, RequestedBy, ShortDescription FROM Request WHERE Number = ?"
             tData = (oArgs.request, )
+            sTableName = 'Request'
 
         oReport = Report(f'Ticket History.')
         oReport.addColumn('TimeStamp', sJust='right')
@@ -1019,11 +1741,11 @@ def ServiceNOWReports():
             print("Incident or request was not found!")
             exit(1)
 
-        sOpened, sResolved, sClosed, sCaller, sCommentsAndWorkNotes, sDescription = lResults[0]
+        sOpened, sResolved, sClosed, sCaller, sDescription = lResults[0]
 
         dtOpened = datetime.strptime(sOpened, sDateTimeFormat)
 
-        lComments = parseCommentsAndWorkNotes(sCommentsAndWorkNotes)
+        lComments = fetchTicketEvents(sTableName, tData[0], bBody=True)
         print(lComments)
 
         oReport.addCells(dtOpened.strftime('%a %-d/%m %H:%M'), 'Opened', sCaller, sDescription)
@@ -1048,62 +1770,67 @@ def ServiceNOWReports():
 
 
 def updateTableEntry():
+    # all the updates are checked first and then written in one transaction, so a bad argument leaves the database unchanged
+    dServices = dict(ds='Data Storage', dp='Data Protection', ci='Compute Infrastructure', sn='Storage Network')
+    lUpdates = []
+
     if oArgs.incident:
         if oDatabase.fetchValue("SELECT COUNT(*) FROM Incident WHERE Number = ?", (oArgs.incident,)) == 0:
             print("Incident does not exist!")
             exit(1)
 
+        dUpdateFields = {}
         if oArgs.notes:
             sNotes: str = oDatabase.fetchValue("SELECT Notes FROM Incident WHERE Number = ?", (oArgs.incident,))
             if oArgs.notes.startswith('+'):
                 oArgs.notes = f"{sNotes} {oArgs.notes[1:]}"
-            oDatabase.execute("UPDATE Incident SET Notes = ? WHERE Number = ?", (oArgs.notes, oArgs.incident))
+            dUpdateFields['Notes'] = oArgs.notes
         if oArgs.service:
-            if oArgs.service.lower() in ['ds', 'dp', 'ci', 'sn']:
-                sService = dict(ds='Data Storage', dp='Data Protection', ci='Compute Infrastructure', sn='Storage Network')[oArgs.service.lower()]
-                oDatabase.execute("UPDATE Incident SET ReportingService = ? WHERE Number = ?", (sService, oArgs.incident))
+            if oArgs.service.lower() in dServices:
+                dUpdateFields['ReportingService'] = dServices[oArgs.service.lower()]
             else:
                 print("Unknown service.")
                 exit(1)
         if oArgs.exclude:
-            oDatabase.execute('UPDATE Incident SET Exclude = 1 WHERE Number = ?', (oArgs.incident, ))
+            dUpdateFields['Exclude'] = 1
 
-        if not (oArgs.notes or oArgs.service or oArgs.exclude):
+        if not dUpdateFields:
             print("Nothing supplied to update!")
             exit(1)
+        lUpdates.append(('Incident', dUpdateFields, dict(Number=oArgs.incident)))
 
     if oArgs.request:
         if oDatabase.fetchValue("SELECT COUNT(*) FROM Request WHERE Number = ?", (oArgs.request,)) == 0:
             print("Request does not exist!")
             exit(1)
 
+        dUpdateFields = {}
         if oArgs.notes:
             sNotes: str = oDatabase.fetchValue("SELECT Notes FROM Request WHERE Number = ?", (oArgs.request,))
             if oArgs.notes.startswith('+'):
                 oArgs.notes = f"{sNotes} {oArgs.notes[1:]}"
-            oDatabase.execute("UPDATE Request SET Notes = ? WHERE Number = ?", (oArgs.notes, oArgs.request))
+            dUpdateFields['Notes'] = oArgs.notes
         if oArgs.service:
-            if oArgs.service.lower() in ['ds', 'dp', 'ci', 'sn']:
-                sService = dict(ds='Data Storage', dp='Data Protection', ci='Compute Infrastructure', sn='Storage Network')[oArgs.service.lower()]
-                oDatabase.execute("UPDATE Request SET Service = ? WHERE Number = ?", (sService, oArgs.request))
+            if oArgs.service.lower() in dServices:
+                dUpdateFields['Service'] = dServices[oArgs.service.lower()]
             else:
                 print("Unknown service.")
                 exit(1)
         if oArgs.exclude:
-            oDatabase.execute('UPDATE Request SET Exclude = 1 WHERE Number = ?', (oArgs.request, ))
+            dUpdateFields['Exclude'] = 1
 
-        if not (oArgs.notes or oArgs.service or oArgs.exclude):
+        if not dUpdateFields:
             print("Nothing supplied to update!")
             exit(1)
+        lUpdates.append(('Request', dUpdateFields, dict(Number=oArgs.request)))
 
     if oArgs.change:
         if oDatabase.fetchValue("SELECT COUNT(*) FROM Change WHERE Number = ?", (oArgs.change,)) == 0:
             print("Change does not exist!")
             exit(1)
         if oArgs.service:
-            if oArgs.service.lower() in ['ds', 'dp', 'ci', 'sn']:
-                sService = dict(ds='Data Storage', dp='Data Protection', ci='Compute Infrastructure', sn='Storage Network')[oArgs.service.lower()]
-                oDatabase.execute("UPDATE Change SET Service = ? WHERE Number = ?", (sService, oArgs.change))
+            if oArgs.service.lower() in dServices:
+                lUpdates.append(('Change', dict(Service=dServices[oArgs.service.lower()]), dict(Number=oArgs.change)))
             else:
                 print("Unknown service.")
                 exit(1)
@@ -1111,28 +1838,167 @@ def updateTableEntry():
             print("Nothing supplied to update!")
             exit(1)
 
+    with oDatabase.transaction():
+        for sTableName, dUpdateFields, dWhereFields in lUpdates:
+            oDatabase.updateRowsUsingDicts(sTableName, [(dUpdateFields, dWhereFields)])
+
 
 def loadDatabaseTable():
-    lDataList = readCSVFile(oArgs.file, encoding='ISO-8859-1')
+    oStats = LoadStats()
+    sFingerprint = fileFingerprint(oArgs.file)
+    sLoaded = fileLoadedOn(oArgs.table, sFingerprint)
+    if sLoaded and not oArgs.force:
+        print(f"File {oArgs.file} was already loaded into {oArgs.table} on {sLoaded}, nothing to do (use --force to load it again).")
+        exit()
+
+    try:
+        loadTableToDatabase(oArgs.table, readCSVFile(oArgs.file, encoding='ISO-8859-1', oStats=oStats), oArgs.batchsize, oArgs.commitrows,
+                            oArgs.loadmode, sFingerprint, oArgs.file, oStats)
+    except UnicodeDecodeError as e:
+        print(f"Error decoding file: {e}")
+        print("Try a different encoding, such as 'ISO-8859-1' or 'latin1'.")
+        print(f"Load of table {oArgs.table} was rolled back.")
+        exit(1)
+    except DatabaseError as exp:
+        print(f"Load of table {oArgs.table} failed and was rolled back: {exp}")
+        exit(1)
+
+    exit()
+
+
+def loadHolidayFile():
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Load the public holidays in the -holidays CSV file into PublicHoliday, replacing the name of any already there.
+    #   The dates can be YYYY-MM-DD or DD/MM/YYYY.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    lHolidays = []
+    try:
+        with open(oArgs.holidays, newline='', encoding='utf-8-sig') as oFile:
+            for dRow in csv.DictReader(oFile):
+                sDate = dRow['Date'].strip()
+                dtHoliday = datetime.strptime(sDate, '%d/%m/%Y') if '/' in sDate else datetime.strptime(sDate, '%Y-%m-%d')
+                lHolidays.append((dRow['Region'].strip(), dtHoliday.strftime('%Y-%m-%d'), (dRow.get('Name') or '').strip()))
+    except (OSError, KeyError, ValueError) as exp:
+        print(f"Public holidays not loaded from {oArgs.holidays}: {exp}")
+        exit(1)
+
+    createHolidayTable(oDatabase)
+    with oDatabase.transaction():
+        oDatabase.executeMany("INSERT INTO PublicHoliday (Region, Holiday, Name) VALUES (?, ?, ?) ON CONFLICT (Region, Holiday) DO UPDATE SET Name = excluded.Name",
+                              lHolidays)
+    print(f"Public holidays loaded - {len(lHolidays)}")
+    exit()
+
+
+def loadPolicyFile():
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Load the SLA targets in the -policies CSV file into SLAPolicy, replacing the target of any policy already there. A blank Service is all services.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    lPolicies = []
+    try:
+        with open(oArgs.policies, newline='', encoding='utf-8-sig') as oFile:
+            for dRow in csv.DictReader(oFile):
+                lPolicies.append((dRow['RecordType'].strip(), dRow['Metric'].strip(), int(dRow['Priority']), (dRow.get('Service') or '').strip(),
+                                  minutesFromDuration(dRow['Target'].strip())))
+    except (OSError, KeyError, ValueError) as exp:
+        print(f"SLA policies not loaded from {oArgs.policies}: {exp}")
+        exit(1)
+
+    createSLAPolicyTable(oDatabase)
+    with oDatabase.transaction():
+        oDatabase.executeMany("INSERT INTO SLAPolicy (RecordType, Metric, Priority, Service, TargetMinutes) VALUES (?, ?, ?, ?, ?) "
+                              "ON CONFLICT (RecordType, Metric, Priority, Service) DO UPDATE SET TargetMinutes = excluded.TargetMinutes", lPolicies)
+    print(f"SLA policies loaded - {len(lPolicies)}")
+    exit()
 
-    # print(lDataList[0])
-    loadTableToDatabase(oArgs.table, lDataList)
+
+def loadDatabaseFileSet():
+    try:
+        loadDatabaseFiles(resolveLoadFiles(oArgs.load), oArgs.batchsize, oArgs.commitrows, oArgs.loadmode, oArgs.workers, bForce=oArgs.force)
+    except (DatabaseError, KeyError) as exp:
+        print(f"Load failed and was rolled back: {exp}")
+        exit(1)
 
     exit()
 
 
+def auditQueryPlans() -> None:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Run EXPLAIN QUERY PLAN on every statement the query statistics collected during this run and propose the indexes that would help,
+    #   creating them if --apply. Registered with atexit so it sees the statements of loads, which exit() when done.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    dStatements = oDatabase.oStats.statements()
+    oStats, oDatabase.oStats = oDatabase.oStats, None
+    try:
+        auditQueries(oDatabase, dStatements, oArgs.apply)
+    except DatabaseError as exp:
+        print(f"Query plan audit failed: {exp}")
+    oDatabase.oStats = oStats
+
+
 if __name__ == '__main__':
     # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
     #   This is the main program. Depending on the command line arguments, do some things
     # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
     oArgs = parseCommandLine()
 
+    # loads don't need every commit synced as the exports can be loaded again, reports don't write at all
+    if oArgs.profile:
+        sProfile = oArgs.profile
+    elif oArgs.table or oArgs.load or oArgs.events:
+        sProfile = 'bulk-load'
+    elif oArgs.update or oArgs.apply or oArgs.holidays or oArgs.policies:
+        sProfile = 'safe'
+    else:
+        sProfile = 'report-readonly'
+
     oDatabase = Database("/Users/waynemoss/Library/CloudStorage/OneDrive-SharedLibraries-HitachiVantara/MS-ANZ RBA - Reserve Bank of Australia - General/"
-                         "Reports/Service Management Report/2024/Database/ServiceNOW.db")
+                         "Reports/Service Management Report/2024/Database/ServiceNOW.db", sProfile, oArgs.snapshot)
+
+    # the routines below exit() when done, closing the database at exit puts back the settings the profile changed and writes back a changed snapshot
+    atexit.register(oDatabase.close)
+
+    if oArgs.querystats:
+        oDatabase.enableStats(oArgs.slowms / 1000)
+        atexit.register(oDatabase.oStats.printSummary)
+
+    if oArgs.holidays:
+        loadHolidayFile()
+
+    if oArgs.policies:
+        loadPolicyFile()
+
+    # every business time calculation uses the one calendar of the region's public holidays, and the SLA breach times are on that calendar
+    oBusinessCalendar = loadBusinessCalendar(oDatabase, oArgs.region, lPublicHolidays)
+    oSLAPolicies = loadSLAPolicies(oDatabase, oBusinessCalendar)
+
+    # the audit needs the statements run, so collect them and run it at exit (before the summary and close as atexit runs in reverse order)
+    if oArgs.audit or oArgs.apply:
+        if oDatabase.oStats is None:
+            oDatabase.enableStats(oArgs.slowms / 1000)
+        atexit.register(auditQueryPlans)
+
+        if not (oArgs.report or oArgs.table or oArgs.load or oArgs.update or oArgs.events):
+            # the reports are only run for their SQL, so they aren't shown or put on the clipboard
+            oArgs.month = oArgs.month or 1
+            GlobalVars.bClipboard = False
+            for iReport in [1, 2, 3, 4]:
+                oArgs.report = iReport
+                with redirect_stdout(io.StringIO()):
+                    ServiceNOWReports()
+            oArgs.report = None
+            GlobalVars.bClipboard = True
 
     if oArgs.update and (oArgs.incident or oArgs.request or oArgs.change):
         updateTableEntry()
 
+    if oArgs.events:
+        for sEventTable in ['Incident', 'Request']:
+            print(f"{sEventTable} tickets with comments parsed - {refreshTicketEvents(sEventTable)}")
+
+    if oArgs.load:
+        loadDatabaseFileSet()
+
     if oArgs.table:
         loadDatabaseTable()
 
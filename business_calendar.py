@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+#   Business time for the SLA calculations. A business day is Monday to Friday, not a public holiday, from 07:00 to 18:00, so 11 hours.
+#   Durations are reported as (days, hours, minutes) of business time, a day being 11 hours.
+#   The public holidays come from the PublicHoliday table by region, each region's calendar is built once and shared for the life of the process.
+#   The ...Array methods do the same calculations for whole columns of timestamps at once with numpy. numpy is only needed by them, and only imported
+#   when they are used, the rest of the program runs without it.
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+
+from datetime import date, datetime, timedelta
+from bisect import bisect_left
+from functools import lru_cache
+from database import Database
+
+
+iDayStart = 7 * 60              # business day start, minutes after midnight
+iDayEnd = 18 * 60               # business day end, minutes after midnight
+iDayMinutes = iDayEnd - iDayStart
+
+dCalendars = {}                 # the calendar of each region loaded, see loadBusinessCalendar()
+
+
+def durationFromMinutes(iMinutes: int) -> tuple[int, int, int]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Split business minutes into (days, hours, minutes) of 11 hour days. Exactly 11 hours stays 0 days 11 hours, only more than that is a day.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    iDays = 0 if iMinutes <= iDayMinutes else (iMinutes - 1) // iDayMinutes
+    iHours, iMinutes = divmod(iMinutes - iDays * iDayMinutes, 60)
+    return iDays, iHours, iMinutes
+
+
+@lru_cache(maxsize=None)
+def minutesFromDuration(sDaysHoursMinutes: str) -> int:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the business minutes in a 'd:hh:mm' SLA target, e.g. '5:00:00' is 5 business days, '0:04:00' 4 hours
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    iDays, iHours, iMinutes = [int(sPart) for sPart in sDaysHoursMinutes.split(':')]
+    return iDays * iDayMinutes + iHours * 60 + iMinutes
+
+
+class BusinessCalendar:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Knows which dates are business days and holds, for a range of dates, the business minutes in all the days before each one.
+    #   The business time between two dates is then the difference of two entries, whatever the distance between them, rather than a count
+    #   made a day at a time. The range grows as dates outside it are asked for.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    def __init__(self, lHolidays: list) -> None:
+        self.setHolidays(lHolidays)
+
+    def setHolidays(self, lHolidays: list) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Use a new list of public holidays (dates), the index is built again as it is needed
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.sHolidays = {dtHoliday.toordinal() for dtHoliday in lHolidays}
+        self.iFirstOrdinal = 0
+        self.lCumulative = []
+        self.oBusDayCalendar = None
+
+    def isBusinessDay(self, dtDate: date) -> bool:
+        return dtDate.weekday() < 5 and dtDate.toordinal() not in self.sHolidays
+
+    def __cover__(self, iFromOrdinal: int, iToOrdinal: int) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine making sure the index covers the dates (as ordinals), building it again with a year either side if it doesn't.
+        #   The index only starts again from an earlier date when one before it is needed, otherwise the entries keep their values.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        iLastOrdinal = self.iFirstOrdinal + len(self.lCumulative) - 1
+        if self.lCumulative and self.iFirstOrdinal <= iFromOrdinal and iToOrdinal <= iLastOrdinal:
+            return
+
+        if self.lCumulative:
+            iFirstOrdinal = self.iFirstOrdinal if iFromOrdinal >= self.iFirstOrdinal else iFromOrdinal - 366
+            iToOrdinal = max(iToOrdinal, iLastOrdinal)
+        else:
+            iFirstOrdinal = iFromOrdinal - 366
+
+        self.iFirstOrdinal = iFirstOrdinal
+        self.lCumulative = [0]
+        iCumulative = 0
+        for iDay in range(iFirstOrdinal, iToOrdinal + 366):
+            if (iDay + 6) % 7 < 5 and iDay not in self.sHolidays:   # (ordinal + 6) % 7 is the weekday(), 0 is Monday
+                iCumulative += iDayMinutes
+            self.lCumulative.append(iCumulative)
+
+    def businessMinutes(self, dtStart: datetime, dtEnd: datetime) -> int:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns the business minutes from dtStart to dtEnd, to the minute (seconds are ignored). On different days this is the rest of the
+        #   start day, the business days between and the end day up to dtEnd. An end on an earlier day than the start counts just those two part days.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        iStart = dtStart.hour * 60 + dtStart.minute
+        iEnd = dtEnd.hour * 60 + dtEnd.minute
+
+        if dtStart.date() == dtEnd.date():
+            if not self.isBusinessDay(dtStart):
+                return 0
+            return max(min(iDayEnd, iEnd) - max(iDayStart, iStart), 0)
+
+        iMinutes = max(iDayEnd - max(iDayStart, iStart), 0) if self.isBusinessDay(dtStart) else 0
+        iFromOrdinal, iToOrdinal = dtStart.toordinal() + 1, dtEnd.toordinal()
+        if iToOrdinal > iFromOrdinal:
+            self.__cover__(iFromOrdinal, iToOrdinal)
+            iMinutes += self.lCumulative[iToOrdinal - self.iFirstOrdinal] - self.lCumulative[iFromOrdinal - self.iFirstOrdinal]
+        if self.isBusinessDay(dtEnd):
+            iMinutes += max(min(iDayEnd, iEnd) - iDayStart, 0)
+        return iMinutes
+
+    def businessDayAfter(self, dtDate: date, iDays: int) -> date:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns the iDays-th business day after the date, found by a binary search of the index for the business minutes that many days take
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        iFromOrdinal = dtDate.toordinal() + 1
+        iToOrdinal = iFromOrdinal + iDays * 2 + 14
+        self.__cover__(iFromOrdinal, iToOrdinal)
+        iTarget = self.lCumulative[iFromOrdinal - self.iFirstOrdinal] + iDays * iDayMinutes
+        while self.lCumulative[-1] < iTarget:
+            iToOrdinal += iDays + 366
+            self.__cover__(iFromOrdinal, iToOrdinal)
+        return date.fromordinal(self.iFirstOrdinal + bisect_left(self.lCumulative, iTarget) - 1)
+
+    def breachTime(self, dtStart: datetime, iTargetMinutes: int) -> datetime:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns when an SLA of iTargetMinutes business minutes, started at dtStart, is breached. The target is taken as whole business days
+        #   and the minutes left over. A start on a non business day starts at 07:00 on the next business day, a start before hours starts at
+        #   07:00 and one after hours at 07:00 with a day more to go. The minutes are added to the start and if that passes midnight the
+        #   13 hours from 18:00 to 07:00 are skipped, if it passes 18:00 the time goes back 11 hours with a day more to go. The days are then
+        #   counted in business days.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        iDays, iMinutes = divmod(iTargetMinutes, iDayMinutes)
+
+        if not self.isBusinessDay(dtStart):
+            dtDate = self.businessDayAfter(dtStart.date(), 1)
+            dtStart = dtStart.replace(year=dtDate.year, month=dtDate.month, day=dtDate.day, hour=iDayStart // 60, minute=iDayStart % 60)
+
+        dtEnd = dtStart
+        iTime = dtStart.hour * 60 + dtStart.minute
+        if iTime < iDayStart:
+            dtEnd = dtStart.replace(hour=iDayStart // 60, minute=iDayStart % 60)
+        if iTime > iDayEnd:
+            iDays += 1
+            dtEnd = dtStart.replace(hour=iDayStart // 60, minute=iDayStart % 60)
+
+        dtEnd += timedelta(minutes=iMinutes)
+        if dtEnd.hour * 60 + dtEnd.minute < iDayStart:
+            dtEnd += timedelta(minutes=24 * 60 - iDayMinutes)
+        if dtEnd.hour * 60 + dtEnd.minute > iDayEnd:
+            iDays += 1
+            dtEnd -= timedelta(minutes=iDayMinutes)
+
+        if iDays:
+            dtDate = self.businessDayAfter(dtEnd.date(), iDays)
+            dtEnd = dtEnd.replace(year=dtDate.year, month=dtDate.month, day=dtDate.day)
+        return dtEnd
+
+    def timeDiff(self, dtStart: datetime, dtEnd: datetime) -> tuple[int, int, int]:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns the business time from dtStart to dtEnd as (days, hours, minutes) of 11 hour days
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        return durationFromMinutes(self.businessMinutes(dtStart, dtEnd))
+
+    def __busDayCalendar__(self):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine returning the holidays as a numpy busdaycalendar (Monday to Friday), made the first time it is needed
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        import numpy as np
+
+        if self.oBusDayCalendar is None:
+            aHolidays = np.array([date.fromordinal(iOrdinal) for iOrdinal in sorted(self.sHolidays)], dtype='datetime64[D]')
+            self.oBusDayCalendar = np.busdaycalendar(weekmask='1111100', holidays=aHolidays)
+        return self.oBusDayCalendar
+
+    def __businessDaysAfter__(self, aDates, aDays):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine, the aDays-th business day after each date as businessDayAfter() does. Rolling back to a business day first means a
+        #   weekend or holiday counts from the business day before it, so the first day after it is still the next business day.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        import numpy as np
+
+        return np.busday_offset(aDates, aDays, roll='backward', busdaycal=self.__busDayCalendar__())
+
+    def businessMinutesArray(self, lStart, lEnd):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   businessMinutes() for each pair of timestamps in two equal length sequences of datetimes (or a numpy datetime64 array) as a numpy int
+        #   array. None of the timestamps can be missing (None or NaT).
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        import numpy as np
+
+        aStart = np.asarray(lStart, dtype='datetime64[m]')
+        aEnd = np.asarray(lEnd, dtype='datetime64[m]')
+        aStartDate = aStart.astype('datetime64[D]')
+        aEndDate = aEnd.astype('datetime64[D]')
+        aStartTime = (aStart - aStartDate).astype(np.int64)
+        aEndTime = (aEnd - aEndDate).astype(np.int64)
+        oBusDayCalendar = self.__busDayCalendar__()
+        aStartBusiness = np.is_busday(aStartDate, busdaycal=oBusDayCalendar)
+        aEndBusiness = np.is_busday(aEndDate, busdaycal=oBusDayCalendar)
+
+        # the same day is the part of it inside business hours, otherwise the rest of the start day, the whole days between and the end day to the end
+        aSameDay = np.maximum(np.minimum(iDayEnd, aEndTime) - np.maximum(iDayStart, aStartTime), 0)
+        aStartDay = np.maximum(iDayEnd - np.maximum(iDayStart, aStartTime), 0)
+        aDaysBetween = np.maximum(np.busday_count(aStartDate + 1, aEndDate, busdaycal=oBusDayCalendar), 0)
+        aEndDay = np.maximum(np.minimum(iDayEnd, aEndTime) - iDayStart, 0)
+
+        aMinutes = np.where(aStartBusiness, aStartDay, 0) + aDaysBetween * iDayMinutes + np.where(aEndBusiness, aEndDay, 0)
+        return np.where(aStartDate == aEndDate, np.where(aStartBusiness, aSameDay, 0), aMinutes)
+
+    def breachTimeArray(self, lStart, lTargetMinutes):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   breachTime() for each start timestamp and target of business minutes (a sequence, or one target for all) as a numpy datetime64[s] array,
+        #   each step applied to every start at once. None of the timestamps can be missing (None or NaT).
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        import numpy as np
+
+        aStart = np.asarray(lStart, dtype='datetime64[s]')
+        aDays, aMinutes = np.divmod(np.broadcast_to(np.asarray(lTargetMinutes, dtype=np.int64), aStart.shape), iDayMinutes)
+
+        aDate = aStart.astype('datetime64[D]')
+        aSeconds = aStart - aStart.astype('datetime64[m]')     # the seconds are kept when the time is moved to 07:00
+        aTime = (aStart.astype('datetime64[m]') - aDate).astype(np.int64)
+
+        aNonBusiness = ~np.is_busday(aDate, busdaycal=self.__busDayCalendar__())
+        aDate = np.where(aNonBusiness, self.__businessDaysAfter__(aDate, 1), aDate)
+        aTime = np.where(aNonBusiness, iDayStart, aTime)
+
+        aDays = aDays + (aTime > iDayEnd)
+        aTime = np.where((aTime < iDayStart) | (aTime > iDayEnd), iDayStart, aTime)
+
+        aEnd = aDate + np.timedelta64(1, 'm') * (aTime + aMinutes) + aSeconds
+        aEndTime = (aEnd.astype('datetime64[m]') - aEnd.astype('datetime64[D]')).astype(np.int64)
+        aEnd = np.where(aEndTime < iDayStart, aEnd + np.timedelta64(24 * 60 - iDayMinutes, 'm'), aEnd)
+        aEndTime = (aEnd.astype('datetime64[m]') - aEnd.astype('datetime64[D]')).astype(np.int64)
+        aAfterHours = aEndTime > iDayEnd
+        aDays = aDays + aAfterHours
+        aEnd = np.where(aAfterHours, aEnd - np.timedelta64(iDayMinutes, 'm'), aEnd)
+
+        aEndDate = aEnd.astype('datetime64[D]')
+        aEndDate = np.where(aDays > 0, self.__businessDaysAfter__(aEndDate, aDays), aEndDate)
+        return aEndDate + (aEnd - aEnd.astype('datetime64[D]'))
+
+    def timeDiffArray(self, lStart, lEnd):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   timeDiff() for each pair of timestamps as three numpy int arrays of the days, hours and minutes, see durationFromMinutes()
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        import numpy as np
+
+        aMinutes = self.businessMinutesArray(lStart, lEnd)
+        aDays = np.where(aMinutes <= iDayMinutes, 0, (aMinutes - 1) // iDayMinutes)
+        aHours, aMinutes = np.divmod(aMinutes - aDays * iDayMinutes, 60)
+        return aDays, aHours, aMinutes
+
+
+def loadHolidays(oDB: Database, sRegion: str) -> list[date]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the public holidays of the region from the PublicHoliday table, all years, or [] if there is no table or none for the region
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    if not oDB.fetchValue("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'PublicHoliday'"):
+        return []
+    return [date.fromisoformat(sHoliday[:10]) for (sHoliday,) in oDB.fetchList("SELECT Holiday FROM PublicHoliday WHERE Region = ? ORDER BY Holiday", (sRegion,))]
+
+
+def loadBusinessCalendar(oDB: Database, sRegion: str, lDefaultHolidays: list) -> BusinessCalendar:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the business calendar of the region, built from its public holidays in the database the first time and the same object after.
+    #   lDefaultHolidays is used if the database has no holidays for the region.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    if sRegion not in dCalendars:
+        dCalendars[sRegion] = BusinessCalendar(loadHolidays(oDB, sRegion) or lDefaultHolidays)
+    return dCalendars[sRegion]
@@ -8,8 +8,27 @@
 
 import sqlite3
 import os
+import asyncio
+import tempfile
+import threading
+from pathlib import Path
+from time import perf_counter
 
-from dict_functions import replaceSingleQuotesInDict
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, groupby, islice
+from functools import lru_cache
+
+
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+#   Named sets of PRAGMA settings for the connection, see Database.applyProfile()
+#   safe            - SQLite's own durable defaults, a rollback journal synced on every commit
+#   bulk-load       - for loading exports that can be loaded again, WAL journal and no syncing, a 256MB page cache and the file memory mapped
+#   report-readonly - for reporting, a 128MB page cache, the file memory mapped, temp b-trees (ORDER BY, GROUP BY) in memory and no writes allowed
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+dPragmaProfiles = {'safe': dict(journal_mode='delete', synchronous='full', cache_size=-2000, mmap_size=0, temp_store='default'),
+                   'bulk-load': dict(journal_mode='wal', synchronous='off', cache_size=-262144, mmap_size=1073741824, temp_store='memory'),
+                   'report-readonly': dict(synchronous='off', cache_size=-131072, mmap_size=1073741824, temp_store='memory', query_only=1)}
 
 
 class DatabaseError(Exception):
@@ -20,39 +39,251 @@ class DatabaseError(Exception):
         super().__init__(sMessage)
 
 
+@lru_cache(maxsize=None)
+def recordClass(tFields: tuple) -> type:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the class used by fetchIter() for rows with these column names. The class has __slots__ rather than a __dict__ so a row
+    #   costs little more than a tuple, the columns are attributes and a row still unpacks like a tuple.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    for sField in tFields:
+        if not sField.isidentifier():
+            raise DatabaseError(f"Column '{sField}' can't be a record attribute, give it an alias.")
+
+    class Record:
+        __slots__ = tFields
+
+        def __init__(self, tRow: tuple) -> None:
+            for sField, oValue in zip(tFields, tRow):
+                setattr(self, sField, oValue)
+
+        def __iter__(self):
+            return (getattr(self, sField) for sField in tFields)
+
+        def __repr__(self) -> str:
+            return 'Record(' + ', '.join([f"{sField}={getattr(self, sField)!r}" for sField in tFields]) + ')'
+
+    return Record
+
+
+class QueryStats:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Collects, for each distinct SQL text run through a Database, the number of calls, the total and longest time taken and the rows returned
+    #   (or changed, for statements that write). Any call taking fSlowSeconds or longer is also kept in the slow query log, with its parameters.
+    #   The parameters of the first call of each statement are kept as a sample, e.g. for running EXPLAIN QUERY PLAN on it later.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    def __init__(self, fSlowSeconds: float = 0.1, iSlowLogSize: int = 100) -> None:
+        self.dQueries = {}
+        self.dSamples = {}
+        self.fSlowSeconds = fSlowSeconds
+        self.iSlowLogSize = iSlowLogSize
+        self.lSlowQueries = []
+
+    def record(self, sSQL: str, tData, fSeconds: float, iRows: int) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Add one call of the statement to the statistics
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        lQuery = self.dQueries.get(sSQL)
+        if lQuery is None:
+            self.dQueries[sSQL] = [1, fSeconds, fSeconds, max(iRows, 0)]
+            self.dSamples[sSQL] = tData
+        else:
+            lQuery[0] += 1
+            lQuery[1] += fSeconds
+            if fSeconds > lQuery[2]:
+                lQuery[2] = fSeconds
+            lQuery[3] += max(iRows, 0)
+
+        if fSeconds >= self.fSlowSeconds and len(self.lSlowQueries) < self.iSlowLogSize:
+            self.lSlowQueries.append((fSeconds, sSQL, tData))
+
+    def statements(self) -> dict:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns a {SQL text: sample parameters} dictionary of every distinct statement recorded, in the order first seen
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        return dict(self.dSamples)
+
+    def printSummary(self, iTop: int = 25, iWidth: int = 120) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Print the iTop statements that took the most time in total, then the slow query log
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        def shortSQL(sSQL: str) -> str:
+            sSQL = ' '.join(sSQL.split())
+            return sSQL if len(sSQL) <= iWidth else sSQL[:iWidth - 1] + '…'
+
+        iCalls = sum([lQuery[0] for lQuery in self.dQueries.values()])
+        fTotal = sum([lQuery[1] for lQuery in self.dQueries.values()])
+        print(f"Query statistics - {len(self.dQueries)} statements, {iCalls:,} calls, {fTotal:.3f}s")
+        print(f"{'Calls':>9} {'Total s':>9} {'Mean ms':>9} {'Max ms':>9} {'Rows':>10}  SQL")
+        for sSQL, (iQueryCalls, fQueryTotal, fQueryMax, iRows) in sorted(self.dQueries.items(), key=lambda tItem: -tItem[1][1])[:iTop]:
+            print(f"{iQueryCalls:>9,} {fQueryTotal:>9.3f} {fQueryTotal / iQueryCalls * 1000:>9.2f} {fQueryMax * 1000:>9.2f} {iRows:>10,}  {shortSQL(sSQL)}")
+
+        if self.lSlowQueries:
+            print(f"Slow queries (over {self.fSlowSeconds * 1000:.0f}ms) - {len(self.lSlowQueries)}{' (log full)' if len(self.lSlowQueries) >= self.iSlowLogSize else ''}")
+            for fSeconds, sSQL, tData in self.lSlowQueries:
+                sData = repr(tData)
+                print(f"{fSeconds * 1000:>9.1f}ms  {shortSQL(sSQL)}  {sData if len(sData) <= 60 else sData[:59] + '…'}")
+
+
 class Database:
     oDBConnection = None
     oDBCursor = None
+    bInTransaction = False
+    iSavepoints = 0
+    sProfile = ''
+    oSourceConnection = None
+    oStats = None
 
-    def __init__(self, sDatabase: str) -> None:
+    def __init__(self, sDatabase: str, sProfile: str = '', sSnapshot: str = '', bReadOnly: bool = False, bThreaded: bool = False) -> None:
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
-        #   Instantiate the database class object, create the connection and cursor.
+        #   Instantiate the database class object, create the connection and cursor, and apply the PRAGMA profile if one is given.
+        #   If sSnapshot is given the database is copied there first and all the work is done on the copy (see __openSnapshot__()).
+        #   bReadOnly opens the file read only, bThreaded lets the connection be used from threads other than the one that opened it,
+        #   the caller must then make sure only one thread uses it at a time (see DatabasePool).
         #   Errors if database is missing or if file doesn't exist.
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.dSavedPragmas = {}
+        self.sSnapshotFile = ''
+        self.tSnapshotState = None
+
         if sDatabase == '':
             raise DatabaseError('Database name is missing.')
 
         if not os.path.exists(sDatabase):
             raise DatabaseError(f"Database '{sDatabase}' doesn't exist.")
         try:
-            self.oDBConnection = sqlite3.connect(sDatabase)
+            if bReadOnly:
+                self.oDBConnection = sqlite3.connect(f"{Path(sDatabase).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=not bThreaded)
+            else:
+                self.oDBConnection = sqlite3.connect(sDatabase, check_same_thread=not bThreaded)
+            if sSnapshot:
+                self.__openSnapshot__(sSnapshot)
             self.oDBCursor = self.oDBConnection.cursor()
         except sqlite3.Error as exp:
             raise DatabaseError(exp)
 
+        if sProfile:
+            self.applyProfile(sProfile)
+
+    def __openSnapshot__(self, sSnapshot: str) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine to copy the database with the backup API into sSnapshot, which is ':memory:', 'temp' for a temporary file that is
+        #   removed on close, or the path of a file. The copy is used from then on, the database itself is only written if close() finds changes.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        if sSnapshot == 'temp':
+            iHandle, sSnapshot = tempfile.mkstemp(suffix='.db')
+            os.close(iHandle)
+            self.sSnapshotFile = sSnapshot
+
+        oSnapshotConnection = sqlite3.connect(sSnapshot)
+        self.oDBConnection.backup(oSnapshotConnection)
+        self.oSourceConnection, self.oDBConnection = self.oDBConnection, oSnapshotConnection
+        self.tSnapshotState = self.__changeState__()
+
+    def __changeState__(self) -> tuple[int, int]:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine returning the rows changed on the connection and the schema version, either moves if the database has been changed
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        return self.oDBConnection.total_changes, self.oDBConnection.execute("PRAGMA schema_version").fetchone()[0]
+
+    def snapshotChanged(self) -> bool:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns True if working on a snapshot and it has been changed since it was taken
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('check snapshot')
+        try:
+            return self.oSourceConnection is not None and self.__changeState__() != self.tSnapshotState
+        except sqlite3.Error as exp:
+            raise DatabaseError(exp)
+
+    def __closeSnapshot__(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine to copy the snapshot back over the database if it was changed, uncommitted changes are discarded as on any close
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        try:
+            if self.oDBConnection.in_transaction:
+                self.oDBConnection.rollback()
+                self.bInTransaction = False
+            if self.snapshotChanged():
+                self.oDBConnection.backup(self.oSourceConnection)
+            self.oSourceConnection.close()
+            self.oSourceConnection = None
+        except sqlite3.Error as exp:
+            raise DatabaseError(exp)
+
+    def applyProfile(self, sProfile: str) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Apply the PRAGMA settings of one of the profiles in dPragmaProfiles. The settings as they were before the first profile was applied
+        #   are kept, and put back by close() (the journal mode is stored in the database file, so it would otherwise stay changed).
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('apply profile')
+        if sProfile not in dPragmaProfiles:
+            raise DatabaseError(f"Unknown database profile '{sProfile}', the profiles are {', '.join(dPragmaProfiles)}.")
+
+        try:
+            for sPragma, oValue in dPragmaProfiles[sProfile].items():
+                # a setting that doesn't apply (mmap_size on an in memory database) has no value to save
+                tValue = self.oDBCursor.execute(f"PRAGMA {sPragma}").fetchone()
+                if sPragma not in self.dSavedPragmas and tValue is not None:
+                    self.dSavedPragmas[sPragma] = tValue[0]
+                self.oDBCursor.execute(f"PRAGMA {sPragma} = {oValue}").fetchall()
+            self.sProfile = sProfile
+        except sqlite3.Error as exp:
+            raise DatabaseError(exp)
+
+    def restorePragmas(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Put back the PRAGMA settings that were in place before a profile was applied. Any uncommitted changes are rolled back first,
+        #   as the journal mode can't be changed inside a transaction.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('restore settings')
+        try:
+            if self.oDBConnection.in_transaction:
+                self.oDBConnection.rollback()
+                self.bInTransaction = False
+            for sPragma, oValue in reversed(list(self.dSavedPragmas.items())):
+                self.oDBCursor.execute(f"PRAGMA {sPragma} = {oValue}").fetchall()
+            self.dSavedPragmas = {}
+            self.sProfile = ''
+        except sqlite3.Error as exp:
+            raise DatabaseError(exp)
+
     def close(self) -> None:
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         #   Closes the database connectio, errors if the database has already been closed.
+        #   The PRAGMA settings changed by a profile are restored first, and a snapshot that has been changed is written back to the database.
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         if self.oDBConnection is None:
             raise DatabaseError('Database connection has already been closed.')
 
+        if self.dSavedPragmas:
+            self.restorePragmas()
+        if self.oSourceConnection is not None:
+            self.__closeSnapshot__()
+
         try:
             self.oDBConnection.close()
             self.oDBConnection = None
         except sqlite3.Error as exp:
             raise DatabaseError(exp)
 
+        if self.sSnapshotFile:
+            os.remove(self.sSnapshotFile)
+            self.sSnapshotFile = ''
+
+    def enableStats(self, fSlowSeconds: float = 0.1) -> QueryStats:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Start collecting query statistics (see QueryStats), returns the collector. Calls taking fSlowSeconds or longer go in the slow query log.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.oStats = QueryStats(fSlowSeconds)
+        return self.oStats
+
+    def __record__(self, sSQL: str, tData, fStart: float, iRows: int) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine to add a call to the query statistics, if they are being collected
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        if self.oStats is not None:
+            self.oStats.record(sSQL, tData, perf_counter() - fStart, iRows)
+
     def errorIfClosed(self, sOperation: str) -> None:
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         #   Raise an error if the database has already been closed.
@@ -65,31 +296,207 @@ class Database:
         #   Execute a parameterised SQL query, using the substituted values in the tData tuple
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         self.errorIfClosed('execute')
+        fStart = perf_counter()
         try:
             self.oDBCursor.execute(sSQL, tData)
+            if not self.bInTransaction:
+                self.oDBConnection.commit()
+            self.__record__(sSQL, tData, fStart, self.oDBCursor.rowcount)
+        except sqlite3.Error as exp:
+            raise DatabaseError(exp)
+
+    def executeMany(self, sSQL: str, lData: list) -> int:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Execute a parameterised SQL query once for every tuple in lData (a list or any iterable), returns the number of rows modified
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('execute')
+        tSample = ()
+        if self.oStats is not None:
+            # the first tuple is kept as the statistics sample, put back in front of the rest so a generator isn't used up
+            iterData = iter(lData)
+            tFirst = next(iterData, None)
+            if tFirst is not None:
+                tSample = tuple(tFirst)
+                lData = chain([tFirst], iterData)
+        fStart = perf_counter()
+        try:
+            self.oDBCursor.executemany(sSQL, lData)
+            if not self.bInTransaction:
+                self.oDBConnection.commit()
+            self.__record__(sSQL, tSample, fStart, self.oDBCursor.rowcount)
+            return self.oDBCursor.rowcount
+        except sqlite3.Error as exp:
+            raise DatabaseError(exp)
+
+    def beginTransaction(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Stop execute() and executeMany() from committing, all changes are held until commitTransaction() or rollbackTransaction()
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('begin transaction')
+        if self.bInTransaction:
+            raise DatabaseError('A transaction is already in progress.')
+        self.bInTransaction = True
+
+    def commitTransaction(self, bEnd: bool = True) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Commit all changes made since the transaction started, if bEnd is False then the transaction carries on for subsequent changes
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('commit')
+        try:
             self.oDBConnection.commit()
+            if bEnd:
+                self.bInTransaction = False
+                self.iSavepoints = 0
+        except sqlite3.Error as exp:
+            raise DatabaseError(exp)
+
+    def rollbackTransaction(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Discard all changes made since the transaction started (or since the last intermediate commit) and end the transaction
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('rollback')
+        try:
+            self.oDBConnection.rollback()
+            self.bInTransaction = False
+            self.iSavepoints = 0
+        except sqlite3.Error as exp:
+            raise DatabaseError(exp)
+
+    def savepoint(self) -> str:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Start a savepoint inside the running transaction and return its name, for releaseSavepoint() or rollbackToSavepoint().
+        #   sqlite3 only begins a transaction before a change, so one is begun here if there hasn't been a change yet, otherwise the savepoint
+        #   would be the transaction and releasing it would commit.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('savepoint')
+        self.iSavepoints += 1
+        sSavepoint = f"Block{self.iSavepoints}"
+        try:
+            if not self.oDBConnection.in_transaction:
+                self.oDBCursor.execute("BEGIN")
+            self.oDBCursor.execute(f"SAVEPOINT {sSavepoint}")
+        except sqlite3.Error as exp:
+            self.iSavepoints -= 1
+            raise DatabaseError(exp)
+        return sSavepoint
+
+    def releaseSavepoint(self, sSavepoint: str) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Keep the changes made since the savepoint as part of the running transaction
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.__endSavepoint__([f"RELEASE {sSavepoint}"])
+
+    def rollbackToSavepoint(self, sSavepoint: str) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Discard the changes made since the savepoint, the rest of the running transaction is kept
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.__endSavepoint__([f"ROLLBACK TO {sSavepoint}", f"RELEASE {sSavepoint}"])
+
+    def __endSavepoint__(self, lStatements: list) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine to release or roll back to a savepoint. An intermediate commitTransaction(bEnd=False) inside the savepoint has already
+        #   committed and ended it, and those changes can't be rolled back, so there is nothing left to do.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('savepoint')
+        self.iSavepoints -= 1
+        try:
+            for sSQL in lStatements:
+                self.oDBCursor.execute(sSQL)
+        except sqlite3.OperationalError as exp:
+            if 'no such savepoint' not in str(exp):
+                raise DatabaseError(exp)
         except sqlite3.Error as exp:
             raise DatabaseError(exp)
 
+    @contextmanager
+    def transaction(self):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Context manager that makes everything done in the block one transaction, committed at the end of the block or rolled back if it raises.
+        #   Inside a transaction that is already running (an outer transaction() block or beginTransaction()) the block is a savepoint, if it raises
+        #   only its own changes are rolled back, otherwise they are kept and the outer transaction decides when everything is committed.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        if self.bInTransaction:
+            sSavepoint = self.savepoint()
+            try:
+                yield self
+            except BaseException:
+                self.rollbackToSavepoint(sSavepoint)
+                raise
+            self.releaseSavepoint(sSavepoint)
+            return
+
+        self.beginTransaction()
+        try:
+            yield self
+        except BaseException:
+            self.rollbackTransaction()
+            raise
+        self.commitTransaction()
+
     def fetchList(self, sSQL: str, tData: tuple = ()) -> list:
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         #   Execute a parameterised SQL query, using the substituted values in the tData tuple, and return a list of the database rows
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         self.errorIfClosed('fetch')
+        fStart = perf_counter()
         try:
             result = self.oDBCursor.execute(sSQL, tData)
-            return result.fetchall()
+            lResults = result.fetchall()
+            self.__record__(sSQL, tData, fStart, len(lResults))
+            return lResults
         except sqlite3.Error as exp:
             raise DatabaseError(exp)
 
+    def fetchIter(self, sSQL: str, tData: tuple = (), iArraySize: int = 500, bRecords: bool = False):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Generator version of fetchList(), the rows are fetched iArraySize at a time so only one chunk is held in memory.
+        #   The query has its own cursor, so other queries can be run while the rows are being read. With bRecords each row is a slotted
+        #   record with the columns as attributes (see recordClass()), otherwise it is a tuple.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('fetch')
+        fStart = perf_counter()
+        fFetching = 0.0
+        iRows = 0
+        try:
+            oCursor = self.oDBConnection.cursor()
+            oCursor.arraysize = iArraySize
+            oCursor.execute(sSQL, tData)
+            fFetching = perf_counter() - fStart
+        except sqlite3.Error as exp:
+            raise DatabaseError(exp)
+
+        # only the time spent in SQLite counts towards the statistics, not the time the caller spends on each row
+        try:
+            oRecord = recordClass(tuple([tColumn[0] for tColumn in oCursor.description])) if bRecords else None
+            while True:
+                fStart = perf_counter()
+                try:
+                    lRows = oCursor.fetchmany()
+                except sqlite3.Error as exp:
+                    raise DatabaseError(exp)
+                fFetching += perf_counter() - fStart
+                iRows += len(lRows)
+                if not lRows:
+                    return
+                if oRecord is None:
+                    yield from lRows
+                else:
+                    for tRow in lRows:
+                        yield oRecord(tRow)
+        finally:
+            oCursor.close()
+            self.__record__(sSQL, tData, perf_counter() - fFetching, iRows)
+
     def fetchValue(self, sSQL: str, tData: tuple = ()) -> any:
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         #   Execute a parameterised SQL query, using the values in the tData tuple, and return the single value expected from the SQL statement
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         self.errorIfClosed('fetch')
+        fStart = perf_counter()
         try:
             result = self.oDBCursor.execute(sSQL, tData)
             lResults = result.fetchall()
+            self.__record__(sSQL, tData, fStart, len(lResults))
             if len(lResults) == 0:
                 return None
             if len(lResults) != 1 and len(lResults[0]) != 1:
@@ -103,9 +510,11 @@ class Database:
         #   Execute a parameterised SQL query, using the values in the tData tuple, and return the tuple from the one row of data returned
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         self.errorIfClosed('fetch')
+        fStart = perf_counter()
         try:
             result = self.oDBCursor.execute(sSQL, tData)
             lResults = result.fetchall()
+            self.__record__(sSQL, tData, fStart, len(lResults))
             if len(lResults) == 0:
                 return None
             if len(lResults) != 1:
@@ -114,36 +523,62 @@ class Database:
         except sqlite3.Error as exp:
             raise DatabaseError(exp)
 
+    @staticmethod
+    def __insertSQL__(sTableName: str, tFields: tuple) -> str:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine returning the parameterised INSERT statement for the fields
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        return f"INSERT INTO \"{sTableName}\" (" + ', '.join([f'"{sField}"' for sField in tFields]) + ') VALUES (' + ', '.join(['?'] * len(tFields)) + ')'
+
+    @staticmethod
+    def __updateSQL__(sTableName: str, tUpdateFields: tuple, tWhereFields: tuple) -> str:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine returning the parameterised UPDATE statement, the SET values are bound first and then the WHERE values
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        return f"UPDATE \"{sTableName}\" SET " + ', '.join([f'"{sField}" = ?' for sField in tUpdateFields]) + ' WHERE ' + \
+               ' AND '.join([f'"{sField}" = ?' for sField in tWhereFields])
+
     def insertIntoTableUsingDict(self, sTableName: str, dFields: dict) -> int:
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
-        #   Insert into table sTableName using the {column name: value} pairs in dictionary dFields
-        #   Single quotes are replaced by two single quotes
+        #   Insert into table sTableName using the {column name: value} pairs in dictionary dFields, the values are bound as parameters
         #   Returns the rowID of the entry that was inserted, this is useful for autoupdate key IDs
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         self.errorIfClosed('insert')
-        replaceSingleQuotesInDict(dFields)
-        sSQL = f"INSERT INTO '{sTableName}' (" + ','.join([f"'{sField}'" for sField in dFields.keys()]) + ')\nVALUES (' +\
-               ','.join([f"{sField}" for sField in dFields.values()]) + ')\n'
-        try:
-            self.execute(sSQL)
-            return self.oDBCursor.lastrowid
-        except sqlite3.Error as exp:
-            raise DatabaseError(exp)
+        self.execute(self.__insertSQL__(sTableName, tuple(dFields)), tuple(dFields.values()))
+        return self.oDBCursor.lastrowid
 
     def updateTableUsingDict(self, sTableName: str, dUpdateFields: dict, dWhereFields: dict) -> None:
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         #   Update fields in table sTableName using the {column name: value} pairs in dictionary dUpdateFields selecting row(s) from dWhereFields.
-        #   Single quotes are replaced by two single quotes in both dictionaries.
+        #   The values are bound as parameters.
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
         self.errorIfClosed('update')
-        replaceSingleQuotesInDict(dUpdateFields)
-        replaceSingleQuotesInDict(dWhereFields)
-        sSQL = f"UPDATE '{sTableName}' \nSET " + ',\n    '.join([f"{sField} = {sValue}" for sField, sValue in dUpdateFields.items()]) + '\nWHERE ' +\
-               'AND\n    '.join([f"{sField} = {sValue}" for sField, sValue in dWhereFields.items()])
-        try:
-            self.execute(sSQL)
-        except sqlite3.Error as exp:
-            raise DatabaseError(exp)
+        self.execute(self.__updateSQL__(sTableName, tuple(dUpdateFields), tuple(dWhereFields)), tuple(dUpdateFields.values()) + tuple(dWhereFields.values()))
+
+    def insertRowsUsingDicts(self, sTableName: str, lRows: list) -> int:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Insert a {column name: value} dictionary per row into table sTableName, in one transaction.
+        #   Each run of rows with the same columns is written by one executemany(). Returns the number of rows inserted.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('insert')
+        iRows = 0
+        with self.transaction():
+            for tFields, iterRows in groupby(lRows, key=tuple):
+                iRows += self.executeMany(self.__insertSQL__(sTableName, tFields), [tuple(dFields.values()) for dFields in iterRows])
+        return iRows
+
+    def updateRowsUsingDicts(self, sTableName: str, lUpdates: list) -> int:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Apply a list of (dUpdateFields, dWhereFields) dictionary pairs to table sTableName, in one transaction.
+        #   Each run of updates with the same columns is written by one executemany(). Returns the number of rows updated.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.errorIfClosed('update')
+        iRows = 0
+        with self.transaction():
+            for (tUpdateFields, tWhereFields), iterUpdates in groupby(lUpdates, key=lambda tUpdate: (tuple(tUpdate[0]), tuple(tUpdate[1]))):
+                iRows += self.executeMany(self.__updateSQL__(sTableName, tUpdateFields, tWhereFields),
+                                          [tuple(dUpdateFields.values()) + tuple(dWhereFields.values()) for dUpdateFields, dWhereFields in iterUpdates])
+        return iRows
 
     def lastRowInserted(self) -> int:
         # ------------------------------------------------------------------------------------------------------------------------------------------------ #
@@ -176,3 +611,205 @@ class Database:
             self.execute(f"DETACH DATABASE {sAlias}")
         except sqlite3.Error as exp:
             raise DatabaseError(exp)
+
+
+class DatabasePool:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   A set of connections to one database file for work spread over threads, e.g. reports run in a ThreadPoolExecutor. A sqlite3 connection
+    #   can't be shared between threads, so each thread reading gets its own read only connection, opened on its first query, up to iReaders of
+    #   them. The connection of a thread that has ended is handed on to the next new thread. Writes all go through the one writer connection,
+    #   one thread at a time.
+    #   The reads and writes have the same names as on Database. Readers only see what the writer has committed, and in the default rollback
+    #   journal mode a write waits for the readers to finish, so WAL journal mode suits reading and writing at the same time better.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    def __init__(self, sDatabase: str, iReaders: int = 4, sProfile: str = 'report-readonly', sWriterProfile: str = '') -> None:
+        if iReaders < 1:
+            raise DatabaseError('A database pool needs at least one reader.')
+
+        self.sDatabase = sDatabase
+        self.iReaders = iReaders
+        self.sProfile = sProfile
+        self.lReaders = []
+        self.oLocal = threading.local()
+        self.oReaderLock = threading.Lock()
+        self.oWriterLock = threading.RLock()
+        self.oWriter = Database(sDatabase, sWriterProfile, bThreaded=True)
+
+    def reader(self) -> Database:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns the read only connection of the calling thread, on the thread's first query taking over one left by a thread that has ended
+        #   or else opening a new one. Errors if more live threads use the pool than it has readers.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        oReader = getattr(self.oLocal, 'oReader', None)
+        if oReader is None:
+            with self.oReaderLock:
+                if self.oWriter is None:
+                    raise DatabaseError('Database pool has been closed.')
+                for lReader in self.lReaders:
+                    if not lReader[0].is_alive():
+                        lReader[0] = threading.current_thread()
+                        oReader = lReader[1]
+                        break
+                else:
+                    if len(self.lReaders) >= self.iReaders:
+                        raise DatabaseError(f"Database pool has {self.iReaders} readers, all in use by other threads.")
+                    oReader = Database(self.sDatabase, self.sProfile, bReadOnly=True, bThreaded=True)
+                    self.lReaders.append([threading.current_thread(), oReader])
+            self.oLocal.oReader = oReader
+        return oReader
+
+    def fetchList(self, sSQL: str, tData: tuple = ()) -> list:
+        return self.reader().fetchList(sSQL, tData)
+
+    def fetchIter(self, sSQL: str, tData: tuple = (), iArraySize: int = 500, bRecords: bool = False):
+        return self.reader().fetchIter(sSQL, tData, iArraySize, bRecords)
+
+    def fetchValue(self, sSQL: str, tData: tuple = ()) -> any:
+        return self.reader().fetchValue(sSQL, tData)
+
+    def fetchValues(self, sSQL: str, tData: tuple = ()) -> any:
+        return self.reader().fetchValues(sSQL, tData)
+
+    def execute(self, sSQL: str, tData: tuple = ()) -> None:
+        with self.writer() as oWriter:
+            oWriter.execute(sSQL, tData)
+
+    def executeMany(self, sSQL: str, lData: list) -> int:
+        with self.writer() as oWriter:
+            return oWriter.executeMany(sSQL, lData)
+
+    @contextmanager
+    def writer(self):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Context manager giving the calling thread the writer connection for the block, other threads wanting to write wait for it.
+        #   Use oWriter.transaction() inside the block to make several writes one transaction.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        with self.oWriterLock:
+            if self.oWriter is None:
+                raise DatabaseError('Database pool has been closed.')
+            yield self.oWriter
+
+    def close(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Close the writer and every reader. Call it once the threads using the pool have finished.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        with self.oReaderLock, self.oWriterLock:
+            if self.oWriter is None:
+                raise DatabaseError('Database pool has already been closed.')
+            for _oThread, oReader in self.lReaders:
+                oReader.close()
+            self.lReaders = []
+            self.oWriter.close()
+            self.oWriter = None
+
+
+class AsyncDatabase:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   asyncio version of Database, the methods are coroutines with the same names and arguments. The connection lives in a thread of its own
+    #   (a single thread executor) and every call is run there, so slow queries or a slow database file don't hold up the event loop.
+    #   Calls run in the order they are made, one at a time, so calls from other tasks made while a transaction is open become part of it.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    def __init__(self, sDatabase: str, sProfile: str = '', sSnapshot: str = '') -> None:
+        self.oDatabase = None
+        self.oExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AsyncDatabase')
+        self.oOpened = self.oExecutor.submit(self.__open__, sDatabase, sProfile, sSnapshot)
+
+    def __open__(self, sDatabase: str, sProfile: str, sSnapshot: str) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine, run in the connection's thread, opening the database. An error opening it is raised again by every call.
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.oDatabase = Database(sDatabase, sProfile, sSnapshot)
+
+    def __dispatch__(self, sMethod: str, tArgs: tuple) -> any:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine, run in the connection's thread, calling the Database method
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        self.oOpened.result()
+        return getattr(self.oDatabase, sMethod)(*tArgs)
+
+    async def __run__(self, sMethod: str, *tArgs) -> any:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Internal routine to run a Database method in the connection's thread and wait for the result without blocking the event loop
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        if self.oExecutor is None:
+            raise DatabaseError(f"Database connection has been closed. Cannot perform {sMethod}.")
+        return await asyncio.get_running_loop().run_in_executor(self.oExecutor, self.__dispatch__, sMethod, tArgs)
+
+    async def execute(self, sSQL: str, tData: tuple = ()) -> None:
+        await self.__run__('execute', sSQL, tData)
+
+    async def executeMany(self, sSQL: str, lData: list) -> int:
+        return await self.__run__('executeMany', sSQL, lData)
+
+    async def fetchList(self, sSQL: str, tData: tuple = ()) -> list:
+        return await self.__run__('fetchList', sSQL, tData)
+
+    async def fetchValue(self, sSQL: str, tData: tuple = ()) -> any:
+        return await self.__run__('fetchValue', sSQL, tData)
+
+    async def fetchValues(self, sSQL: str, tData: tuple = ()) -> any:
+        return await self.__run__('fetchValues', sSQL, tData)
+
+    async def fetchIter(self, sSQL: str, tData: tuple = (), iArraySize: int = 500, bRecords: bool = False):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Async generator version of fetchList(), each chunk of iArraySize rows is fetched in the connection's thread (see Database.fetchIter())
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        iterRows = await self.__run__('fetchIter', sSQL, tData, iArraySize, bRecords)
+        oLoop = asyncio.get_running_loop()
+        try:
+            while lRows := await oLoop.run_in_executor(self.oExecutor, lambda: list(islice(iterRows, iArraySize))):
+                for oRow in lRows:
+                    yield oRow
+        finally:
+            if self.oExecutor is not None:
+                await oLoop.run_in_executor(self.oExecutor, iterRows.close)
+
+    async def beginTransaction(self) -> None:
+        await self.__run__('beginTransaction')
+
+    async def commitTransaction(self, bEnd: bool = True) -> None:
+        await self.__run__('commitTransaction', bEnd)
+
+    async def rollbackTransaction(self) -> None:
+        await self.__run__('rollbackTransaction')
+
+    @asynccontextmanager
+    async def transaction(self):
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Async context manager version of Database.transaction(), a savepoint inside a transaction already running
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        await asyncio.wrap_future(self.oOpened)
+        if self.oDatabase.bInTransaction:
+            sSavepoint = await self.__run__('savepoint')
+            try:
+                yield self
+            except BaseException:
+                await self.__run__('rollbackToSavepoint', sSavepoint)
+                raise
+            await self.__run__('releaseSavepoint', sSavepoint)
+            return
+
+        await self.beginTransaction()
+        try:
+            yield self
+        except BaseException:
+            await self.rollbackTransaction()
+            raise
+        await self.commitTransaction()
+
+    async def attachDatabase(self, sPath: str, sAlias: str) -> None:
+        await self.__run__('attachDatabase', sPath, sAlias)
+
+    async def detachDatabase(self, sAlias: str) -> None:
+        await self.__run__('detachDatabase', sAlias)
+
+    async def close(self) -> None:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Close the database (see Database.close()) and end the connection's thread
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        try:
+            await self.__run__('close')
+        finally:
+            if self.oExecutor is not None:
+                self.oExecutor.shutdown(wait=False)
+                self.oExecutor = None
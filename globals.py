@@ -22,7 +22,9 @@ class GlobalVars:
     #   oArgs is the command line arguments passed in
     #   oDatabase is the sqlite3 database wrapper object
     #   oProgress is the main progress bar container
+    #   bClipboard is False when the report tables are not to be copied to the clipboard
     # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
     oArgs: Union[Namespace, None] = None
     oDatabase: Union[Database, None] = None
     oProgress: Union[Progress, None] = None
+    bClipboard: bool = True
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+#   Runs EXPLAIN QUERY PLAN on the statements collected by the query statistics and proposes the indexes that would avoid full table scans,
+#   temporary B-trees for sorting and grouping, and lookups that have to go back to the table for columns the index doesn't hold
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+
+import re
+from database import Database, DatabaseError
+
+
+iMaxIndexColumns = 6         # an index is only made covering if that takes no more columns than this
+
+oSelectPattern = re.compile(r"^SELECT (?P<columns>.+?) FROM (?P<table>[\w.\"]+)(?: AS \w+)?(?: WHERE (?P<where>.+?))?(?: GROUP BY (?P<group>.+?))?"
+                            r"(?: ORDER BY (?P<order>.+?))?(?: LIMIT .+)?$", re.IGNORECASE)
+oUpdatePattern = re.compile(r"^UPDATE (?P<table>[\w.\"]+) SET (?P<columns>.+?) WHERE (?P<where>.+)$", re.IGNORECASE)
+oDeletePattern = re.compile(r"^DELETE FROM (?P<table>[\w.\"]+) WHERE (?P<where>.+)$", re.IGNORECASE)
+oEqualPattern = re.compile(r"^(?P<column>[\w.\"]+) (?:= \S+|IS NULL)$", re.IGNORECASE)
+oRangePattern = re.compile(r"^(?P<column>[\w.\"]+) (?:>=?|<=?) \S+$")
+oOtherPattern = re.compile(r"^(?P<column>[\w.\"]+) (?:<>|!=|LIKE|NOT LIKE|IN) .+$", re.IGNORECASE)
+oSearchPattern = re.compile(r"^SEARCH (?P<table>\w+)(?: AS \w+)? USING (?:(?P<covering>COVERING )?INDEX (?P<index>\w+)|INTEGER PRIMARY KEY|PRIMARY KEY)"
+                            r"(?: \((?P<terms>.*)\))?$")
+lSkipPrefixes = ['PRAGMA', 'CREATE', 'DROP', 'ALTER', 'ATTACH', 'DETACH', 'BEGIN', 'COMMIT', 'ROLLBACK', 'EXPLAIN', 'INSERT']
+
+
+def explainQueryPlan(oDB: Database, sSQL: str, tData=()) -> list[str]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the detail lines of the query plan SQLite would use for the statement with these parameters
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    return [sDetail for _iID, _iParent, _iNotUsed, sDetail in oDB.fetchList(f"EXPLAIN QUERY PLAN {sSQL}", tData)]
+
+
+def tableIndexes(oDB: Database, sTableName: str) -> dict:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns a {index name: (unique, [columns])} dictionary of the indexes on the table, including those behind PRIMARY KEY and UNIQUE constraints
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    dIndexes = {}
+    for tIndex in oDB.fetchList(f"PRAGMA index_list(\"{sTableName}\")"):
+        sIndexName, bUnique = tIndex[1], bool(tIndex[2])
+        dIndexes[sIndexName] = (bUnique, [tColumn[2] for tColumn in oDB.fetchList(f"PRAGMA index_info(\"{sIndexName}\")")])
+    return dIndexes
+
+
+def __columnName__(sColumn: str) -> str:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Strip the schema or alias qualifier and the quotes from a column reference
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    return sColumn.split('.')[-1].strip('"')
+
+
+def __splitList__(sList: str) -> list[str]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Split a comma separated SQL list, ignoring commas inside brackets
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    lItems, iDepth, iStart = [], 0, 0
+    for iPosition, sChar in enumerate(sList):
+        if sChar == '(':
+            iDepth += 1
+        elif sChar == ')':
+            iDepth -= 1
+        elif sChar == ',' and iDepth == 0:
+            lItems.append(sList[iStart:iPosition].strip())
+            iStart = iPosition + 1
+    lItems.append(sList[iStart:].strip())
+    return lItems
+
+
+def parseStatement(sSQL: str) -> dict:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Break a single table SELECT, UPDATE or DELETE down into the parts an index can serve: the columns compared for equality, the first column
+    #   compared by range, the ORDER BY (or GROUP BY) columns, the other columns filtered on and the columns read.
+    #   Returns {} for statements that join, use sub-queries or OR, as the proposals would only be guesses for those.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    sSQL = ' '.join(sSQL.split())
+    if re.search(r"\(SELECT | JOIN | OR | FROM \S+ (?:AS \w+ )?,|^UPDATE .* FROM ", sSQL, re.IGNORECASE):
+        return {}
+
+    oMatch = oSelectPattern.match(sSQL) or oUpdatePattern.match(sSQL) or oDeletePattern.match(sSQL)
+    if oMatch is None:
+        return {}
+
+    dParts = {'table': __columnName__(oMatch['table']), 'equal': [], 'range': '', 'order': [], 'other': [], 'read': [], 'coverable': True}
+    for sPredicate in re.split(r" AND ", oMatch['where'], flags=re.IGNORECASE) if oMatch['where'] else []:
+        if oPredicate := oEqualPattern.match(sPredicate):
+            dParts['equal'].append(__columnName__(oPredicate['column']))
+        elif oPredicate := oRangePattern.match(sPredicate):
+            dParts['range'] = dParts['range'] or __columnName__(oPredicate['column'])
+            dParts['other'].append(__columnName__(oPredicate['column']))
+        elif oPredicate := oOtherPattern.match(sPredicate):
+            dParts['other'].append(__columnName__(oPredicate['column']))
+        else:
+            return {}
+
+    if sSQL.upper().startswith('SELECT'):
+        sOrder = oMatch['group'] or oMatch['order'] or ''
+        for sColumn in __splitList__(sOrder) if sOrder else []:
+            if not re.fullmatch(r"[\w.\"]+(?: ASC)?", sColumn, re.IGNORECASE):
+                break
+            dParts['order'].append(__columnName__(sColumn.split()[0]))
+        for sColumn in __splitList__(oMatch['columns']):
+            sColumn = re.sub(r" AS \w+$", '', sColumn, flags=re.IGNORECASE)
+            if re.fullmatch(r"[\w.\"]+", sColumn):
+                dParts['read'].append(__columnName__(sColumn))
+            elif sColumn.upper() != 'COUNT(*)':
+                dParts['coverable'] = False
+    else:
+        dParts['coverable'] = False
+    return dParts
+
+
+def proposeIndex(dParts: dict) -> tuple[list[str], int]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the columns of the index that suits the statement best: equality columns first, then the sort order (or else the range column)
+    #   and then, if it doesn't make the index too wide, every other column the statement filters on or reads so the table needn't be read at all.
+    #   The number of leading columns the statement seeks or sorts on is returned with them, the rest are only there to cover it.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    lColumns = []
+
+    def addColumns(lAdd: list) -> None:
+        for sColumn in lAdd:
+            if sColumn.lower() != 'rowid' and sColumn not in lColumns:
+                lColumns.append(sColumn)
+
+    addColumns(dParts['equal'])
+    if dParts['order']:
+        addColumns(dParts['order'])
+    elif dParts['range']:
+        addColumns([dParts['range']])
+    lColumns = lColumns[:iMaxIndexColumns]
+    iKeyColumns = len(lColumns)
+    if not lColumns:
+        return [], 0
+
+    lCovering = list(lColumns)
+    for sColumn in dParts['other'] + dParts['read']:
+        if sColumn.lower() != 'rowid' and sColumn not in lCovering:
+            lCovering.append(sColumn)
+    if dParts['coverable'] and len(lCovering) <= iMaxIndexColumns:
+        return lCovering, iKeyColumns
+    return lColumns, iKeyColumns
+
+
+def planProblems(oDB: Database, lPlan: list[str]) -> list[str]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the lines of the query plan worth fixing. A SEARCH that isn't covering is only flagged if it can match more than one row,
+    #   a lookup of a full unique key reads one row from the table whatever the index holds.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    lProblems = []
+    for sDetail in lPlan:
+        if sDetail.startswith('SCAN ') and ' USING COVERING INDEX ' not in sDetail and 'CONSTANT ROW' not in sDetail:
+            lProblems.append(sDetail)
+        elif sDetail.startswith('USE TEMP B-TREE'):
+            lProblems.append(sDetail)
+        elif oSearch := oSearchPattern.match(sDetail):
+            if oSearch['covering'] or oSearch['index'] is None:
+                continue
+            bUnique, lIndexColumns = tableIndexes(oDB, oSearch['table']).get(oSearch['index'], (False, []))
+            lEqualColumns = re.findall(r"(\w+)=\?", oSearch['terms'] or '')
+            if not (bUnique and set(lIndexColumns) <= set(lEqualColumns)):
+                lProblems.append(f"{sDetail} (not covering)")
+    return lProblems
+
+
+def auditQueries(oDB: Database, dStatements: dict, bApply: bool = False) -> list[str]:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Explain every statement in the {SQL text: sample parameters} dictionary and print the plan lines that need attention, with the
+    #   CREATE INDEX statements that would fix them. Proposals already served by an existing index, or by a wider proposal, are dropped.
+    #   If bApply the indexes are created and the flagged statements explained again to show the new plans.
+    #   Returns the CREATE INDEX statements.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    dProposals = {}
+    lFlagged = []
+    iChecked = 0
+    for sSQL, tData in dStatements.items():
+        sShortSQL = ' '.join(sSQL.split())
+        if sShortSQL.split(' ', 1)[0].upper() in lSkipPrefixes or 'sqlite_' in sShortSQL:
+            continue
+
+        try:
+            lPlan = explainQueryPlan(oDB, sSQL, tData if isinstance(tData, (tuple, list, dict)) else ())
+        except DatabaseError as exp:
+            print(f"Not checked - {exp} - {sShortSQL if len(sShortSQL) <= 100 else sShortSQL[:99] + '…'}")
+            continue
+        iChecked += 1
+
+        lProblems = planProblems(oDB, lPlan)
+        if not lProblems:
+            continue
+        lFlagged.append(sSQL)
+
+        print(sShortSQL)
+        for sProblem in lProblems:
+            print(f"    {sProblem}")
+
+        dParts = parseStatement(sSQL)
+        lColumns, iKeyColumns = proposeIndex(dParts) if dParts else ([], 0)
+        if not lColumns:
+            print("    No index proposed, the statement has nothing an index can serve or is too complex to judge.")
+            continue
+        for sIndexName, (_bUnique, lIndexColumns) in tableIndexes(oDB, dParts['table']).items():
+            if lIndexColumns[:len(lColumns)] == lColumns:
+                print(f"    Index {sIndexName} already has the proposed columns ({', '.join(lColumns)}).")
+                break
+        else:
+            dProposals.setdefault(dParts['table'], []).append((lColumns, iKeyColumns))
+
+    # an index is left out if another proposed for the table seeks and sorts on the same leading columns and holds all its columns too
+    lCreates = []
+    for sTableName, lTableProposals in dProposals.items():
+        for iProposal, (lColumns, iKeyColumns) in enumerate(lTableProposals):
+            if any([lOther[:iKeyColumns] == lColumns[:iKeyColumns] and set(lColumns) <= set(lOther) and (set(lColumns) < set(lOther) or iOther < iProposal)
+                    for iOther, (lOther, _iOtherKeyColumns) in enumerate(lTableProposals) if iOther != iProposal]):
+                continue
+            sIndexName = f"IX_{sTableName}_{'_'.join(lColumns)}"
+            sColumns = ', '.join([f'"{sColumn}"' for sColumn in lColumns])
+            lCreates.append(f'CREATE INDEX IF NOT EXISTS "{sIndexName}" ON "{sTableName}" ({sColumns})')
+
+    print(f"Query plan audit - {iChecked} statements checked, {len(lFlagged)} flagged, {len(lCreates)} indexes proposed")
+    for sCreate in lCreates:
+        print(f"    {sCreate};")
+
+    # each index is created on its own (sqlite3 commits DDL as it runs so a transaction wouldn't hold them back), one failing doesn't stop the rest
+    if bApply and lCreates:
+        iCreated = 0
+        for sCreate in lCreates:
+            try:
+                oDB.execute(sCreate)
+                iCreated += 1
+                print(f"    Created - {sCreate}")
+            except DatabaseError as exp:
+                print(f"    Failed  - {sCreate}: {exp}")
+        print(f"{iCreated} of {len(lCreates)} indexes created, plans are now (<- still needs attention)")
+        for sSQL in lFlagged:
+            tData = dStatements[sSQL]
+            lPlan = explainQueryPlan(oDB, sSQL, tData if isinstance(tData, (tuple, list, dict)) else ())
+            print(' '.join(sSQL.split()))
+            for sDetail in lPlan:
+                print(f"    {sDetail}{' <-' if planProblems(oDB, [sDetail]) else ''}")
+
+    return lCreates
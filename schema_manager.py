@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+#   Knows the key and update fields of the ServiceNOW tables and manages the indexes the loader relies on
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+
+from database import Database, DatabaseError
+
+
+# keys are the fields that identify a row, update is the field that changes whenever ServiceNOW changes the row ('' means there isn't one)
+dTableDefinitions = {'Incident': dict(keys=['Number'], update='Updated'),
+                     'IncidentSLA': dict(keys=['Number', 'SLADefinition', 'Stage'], update='StopTime'),
+                     'Request': dict(keys=['Number'], update='Updated'),
+                     'Change': dict(keys=['Number'], update='')}
+
+
+def tableKeyFields(sTableName: str) -> list:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the list of fields that make up the unique key of the table
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    if sTableName not in dTableDefinitions:
+        raise DatabaseError(f"Table '{sTableName}' is not a table that can be loaded.")
+    return list(dTableDefinitions[sTableName]['keys'])
+
+
+def tableUpdateField(sTableName: str) -> str:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the field that records when the row was last changed, or '' if the table doesn't have one
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    if sTableName not in dTableDefinitions:
+        raise DatabaseError(f"Table '{sTableName}' is not a table that can be loaded.")
+    return dTableDefinitions[sTableName]['update']
+
+
+def createKeyIndex(oDB: Database, sTableName: str, bUnique: bool = True) -> None:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Create the UNIQUE index on the key fields of the table, if it isn't already there. This is what ON CONFLICT in the loader matches against.
+    #   Errors, naming the first duplicate, if the table already holds a key more than once.
+    #   With bUnique False, for loads that only look rows up by key, a plain index is created instead unless the UNIQUE one is already there,
+    #   as the table may hold a key more than once.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    lKeyFields = tableKeyFields(sTableName)
+    sKeyFields = ', '.join(lKeyFields)
+    sIndexName = f"IX_{sTableName}_Key"
+
+    if oDB.fetchValue("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND name = ?", (sIndexName,)):
+        return
+
+    if not bUnique:
+        oDB.execute(f"CREATE INDEX IF NOT EXISTS IX_{sTableName}_KeyLookup ON {sTableName} ({sKeyFields})")
+        return
+
+    tDuplicate = oDB.fetchValues(f"SELECT {sKeyFields} FROM {sTableName} GROUP BY {sKeyFields} HAVING COUNT(*) > 1 LIMIT 1")
+    if tDuplicate:
+        raise DatabaseError(f"Cannot create unique index {sIndexName}, table {sTableName} has key {tDuplicate} more than once.")
+
+    oDB.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {sIndexName} ON {sTableName} ({sKeyFields})")
+
+
+def createLoadTables(oDB: Database) -> None:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Create the side tables the loader uses to recognise files and rows it has already loaded.
+    #   LoadedFile has the fingerprint of every file loaded, RowFingerprint has a content hash for every row by table and key.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    oDB.execute("CREATE TABLE IF NOT EXISTS LoadedFile (TableName TEXT NOT NULL, Fingerprint TEXT NOT NULL, FileName TEXT, Rows INTEGER, Loaded TEXT, "
+                "PRIMARY KEY (TableName, Fingerprint))")
+    oDB.execute("CREATE TABLE IF NOT EXISTS RowFingerprint (TableName TEXT NOT NULL, RowKey TEXT NOT NULL, Hash TEXT NOT NULL, "
+                "PRIMARY KEY (TableName, RowKey)) WITHOUT ROWID")
+
+
+def createTicketEventTables(oDB: Database) -> None:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Create the tables holding the parsed comments and work notes. TicketEvent has one row per update in time order (Seq) for each ticket,
+    #   TicketEventSource has the hash of the comments text each ticket was last parsed from, so unchanged tickets aren't parsed again.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    oDB.execute("CREATE TABLE IF NOT EXISTS TicketEvent (Number TEXT NOT NULL, Seq INTEGER NOT NULL, Timestamp TEXT NOT NULL, Person TEXT, UpdateType TEXT, "
+                "Body TEXT, PRIMARY KEY (Number, Seq)) WITHOUT ROWID")
+    oDB.execute("CREATE INDEX IF NOT EXISTS IX_TicketEvent_Time ON TicketEvent (Number, Timestamp)")
+    oDB.execute("CREATE TABLE IF NOT EXISTS TicketEventSource (Number TEXT NOT NULL PRIMARY KEY, Hash TEXT NOT NULL) WITHOUT ROWID")
+
+
+def createHolidayTable(oDB: Database) -> None:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Create the table of public holidays used by the business time calculations, one row per region and date (YYYY-MM-DD)
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    oDB.execute("CREATE TABLE IF NOT EXISTS PublicHoliday (Region TEXT NOT NULL, Holiday TEXT NOT NULL, Name TEXT, PRIMARY KEY (Region, Holiday)) WITHOUT ROWID")
+
+
+def createSLAPolicyTable(oDB: Database) -> None:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Create the table of SLA targets in business minutes by record type, metric (Response or Resolve), priority and service ('' for all services)
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    oDB.execute("CREATE TABLE IF NOT EXISTS SLAPolicy (RecordType TEXT NOT NULL, Metric TEXT NOT NULL, Priority INTEGER NOT NULL, Service TEXT NOT NULL DEFAULT '', "
+                "TargetMinutes INTEGER NOT NULL, PRIMARY KEY (RecordType, Metric, Priority, Service)) WITHOUT ROWID")
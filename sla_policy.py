@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+#   The SLA targets by record type (Incident, Request), metric (Response, Resolve), priority and service, held as business minutes.
+#   They come from the SLAPolicy table, where a Service of '' applies to every service without a row of its own. The targets used before the table
+#   existed are the defaults for a database without one.
+# -------------------------------------------------------------------------------------------------------------------------------------------------------- #
+
+from datetime import datetime
+from database import Database, DatabaseError
+from business_calendar import BusinessCalendar, iDayMinutes, minutesFromDuration
+
+
+# the 'd:hh:mm' targets by priority (index 1 to 5) used when the database has no SLA policies
+dDefaultTargets = {('Incident', 'Response'): ['', '0:00:10', '0:00:30', '0:01:00', '0:04:00', '0:08:00'],
+                   ('Incident', 'Resolve'): ['', '0:01:00', '0:04:00', '0:10:00', '5:00:00', '20:00:00'],
+                   ('Request', 'Response'): ['', '0:00:10', '0:00:30', '0:01:00', '0:04:00', '0:08:00'],
+                   ('Request', 'Resolve'): ['', '0:02:00', '1:00:00', '5:00:00', '10:00:00', '260:00:00']}
+
+
+def formatTarget(iTargetMinutes: int) -> str:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns business minutes as a 'd:hh:mm' target, the inverse of minutesFromDuration(), e.g. 240 is '0:04:00' and 3300 is '5:00:00'
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    iDays, iMinutes = divmod(iTargetMinutes, iDayMinutes)
+    iHours, iMinutes = divmod(iMinutes, 60)
+    return f"{iDays}:{iHours:02}:{iMinutes:02}"
+
+
+class SLAPolicies:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   The SLA targets, and when each is breached on the business calendar. The breach times are kept by received time and target, as many tickets
+    #   arrive at the same time (bulk requests, the start of day for those received out of hours) and the same ticket is checked by several reports.
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    def __init__(self, oCalendar: BusinessCalendar, dTargets: dict) -> None:
+        self.oCalendar = oCalendar
+        self.dTargets = dTargets            # {(record type, metric, priority, service): business minutes}
+        self.dBreachTimes = {}
+
+    def targetMinutes(self, sRecordType: str, sMetric: str, iPriority: int, sService: str = '') -> int:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns the target in business minutes, the service's own if it has one otherwise the one for all services
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        iTargetMinutes = self.dTargets.get((sRecordType, sMetric, iPriority, sService))
+        if iTargetMinutes is None:
+            iTargetMinutes = self.dTargets.get((sRecordType, sMetric, iPriority, ''))
+        if iTargetMinutes is None:
+            raise DatabaseError(f"There is no SLA policy for {sRecordType} {sMetric} P{iPriority}.")
+        return iTargetMinutes
+
+    def target(self, sRecordType: str, sMetric: str, iPriority: int, sService: str = '') -> str:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns the target as 'd:hh:mm' for the reports
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        return formatTarget(self.targetMinutes(sRecordType, sMetric, iPriority, sService))
+
+    def breachTime(self, dtReceived: datetime, sRecordType: str, sMetric: str, iPriority: int, sService: str = '') -> datetime:
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        #   Returns when the SLA of a ticket received at dtReceived is breached, see BusinessCalendar.breachTime()
+        # ------------------------------------------------------------------------------------------------------------------------------------------------ #
+        tKey = (dtReceived, self.targetMinutes(sRecordType, sMetric, iPriority, sService))
+        if tKey not in self.dBreachTimes:
+            self.dBreachTimes[tKey] = self.oCalendar.breachTime(*tKey)
+        return self.dBreachTimes[tKey]
+
+
+def defaultTargets() -> dict:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the targets in dDefaultTargets as {(record type, metric, priority, ''): business minutes}
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    return {(sRecordType, sMetric, iPriority, ''): minutesFromDuration(sTarget)
+            for (sRecordType, sMetric), lTargets in dDefaultTargets.items() for iPriority, sTarget in enumerate(lTargets) if sTarget}
+
+
+def loadSLAPolicies(oDB: Database, oCalendar: BusinessCalendar) -> SLAPolicies:
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    #   Returns the SLA policies in the SLAPolicy table, or the defaults if there is no table or it is empty
+    # ---------------------------------------------------------------------------------------------------------------------------------------------------- #
+    dTargets = {}
+    if oDB.fetchValue("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'SLAPolicy'"):
+        for sRecordType, sMetric, iPriority, sService, iTargetMinutes in oDB.fetchList("SELECT RecordType, Metric, Priority, Service, TargetMinutes "
+                                                                                        "FROM SLAPolicy"):
+            dTargets[(sRecordType, sMetric, iPriority, sService)] = iTargetMinutes
+    return SLAPolicies(oCalendar, dTargets or defaultTargets())